@@ -1,26 +1,62 @@
+import itertools
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
-from multiprocessing import Pool
+from matplotlib.figure import Figure
+from multiprocessing import Pool, shared_memory
 from scipy.stats import t
 from tqdm import tqdm
 
-class FracND:
-    class Worker:
-        def __call__(self, window):
-            window = window.squeeze()
-            # Transform window to binary
-            binary_window = np.where(window > 0, 1, 0)
-            # Calculate whether the window is empty
-            touched = 1 - np.all(binary_window == 0).astype(int)
+# Numba is optional, without it the box sums fall back to vectorized NumPy
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# State of the scale worker processes, set once per process by _init_scale_worker
+_worker_state = {}
+
+
+class _SharedArray:
+    """
+    Picklable handle of an array placed in shared memory, the workers attach to the block instead of copying it
+    """
+    def __init__(self, array):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self.shm.name
+        self.shape = array.shape
+        self.dtype = array.dtype
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)[...] = array
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype}
 
-            # Calculate the mass within the window
-            mass = np.sum(window).astype(float)
+    def attach(self):
+        self.shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
 
-            return touched, mass
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
 
 
-    def __init__(self, max_box_size = None, min_box_size = 1, stride = 1, n_samples = 20, subsample = None, multiprocess = True, **kwargs):
+def _init_scale_worker(window_statistics, args):
+    # Forked workers inherit the random state of the parent, reseed so the subsampling differs between scales
+    np.random.seed()
+    # The handles are kept in the state so their blocks stay mapped while the arrays are used
+    _worker_state['shared'] = [arg for arg in args if isinstance(arg, _SharedArray)]
+    _worker_state['window_statistics'] = window_statistics
+    _worker_state['args'] = [arg.attach() if isinstance(arg, _SharedArray) else arg for arg in args]
+
+
+def _scale_task(task):
+    window_size, step_size = task
+    return _worker_state['window_statistics'](*_worker_state['args'], window_size, step_size)
+
+
+class FracND:
+    def __init__(self, max_box_size = None, min_box_size = 1, stride = 1, n_samples = 20, subsample = None, multiprocess = True, progress = True, **kwargs):
         self.max_box_size = max_box_size
         self.min_box_size = min_box_size
         self.stride = stride
@@ -30,9 +66,10 @@ class FracND:
         self.subsample = subsample
         if subsample is not None:
             print("Subsampling is enabled. This will result in decreased accuracy.")
+        # The scales are distributed over a single pool of worker processes
         self.multiprocess = multiprocess
-        if not multiprocess:
-            print("Multiprocessing is disabled. This will result in drastically slower calculations.")
+        # Progress bar over the scales, turned off when several calculations run side by side
+        self.progress = progress
         self.kwargs = kwargs
         if 'histogram' in self.kwargs:
             self.histogram = self.kwargs['histogram']
@@ -42,12 +79,30 @@ class FracND:
                 self.bins = 'auto'
         else:
             self.histogram = False
+        # Work buffer for the window sums, grown to the largest single window grid and reused across scales and calls
+        self._buffer = None
+
+
+    def __getstate__(self):
+        # The work buffer is not sent to the worker processes, every worker allocates its own
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        return state
 
 
-    def sliding_window_statistics(self, input_array, window_size, step_size):
-        # Get the shape of the input array
-        shape = input_array.shape
+    def window_buffer(self, shape):
+        """
+        Uninitialized float64 array of the given shape, backed by the work buffer of the instance
+        :param shape:
+        :return:
+        """
+        size = int(np.prod(shape))
+        if self._buffer is None or self._buffer.size < size:
+            self._buffer = np.empty(size, dtype=np.float64)
+        return self._buffer[:size].reshape(shape)
 
+
+    def normalization(self, shape, window_size, step_size):
         # Calculate the number of windows in each dimension
         window_counts = [int((shape[i] - window_size) / step_size) + 1 for i in range(len(shape))]
         box_window_counts = [int((shape[i] - window_size) / window_size) + 1 for i in range(len(shape))]
@@ -58,76 +113,116 @@ class FracND:
         else:
             # TODO: This is not a good approximation, look for a better one!
             norm = np.prod(box_window_counts)/(np.prod(window_counts)*self.subsample)
+        return norm
 
-        # Declare the helper function to calculate the statistics for a single window
-        window_func = self.Worker()
 
-        # Create a pool of workers
-        if self.multiprocess:
-            pool = Pool()
-
-        # Iterate over the windows
-        res = []
-        for index in np.ndindex(*window_counts):
-            # Optional subsampling
-            # Note, this will result in decreased accuracy
-            if self.subsample is not None:
-                smpl = np.random.binomial(1, self.subsample)
-                # If the sample is 0, skip this window, speeding up the calculation
-                if smpl == 0:
-                    continue
-            # Calculate the start and end indices of the window in each dimension
-            start = [i * step_size for i in index]
-            end = [i + window_size for i in start]
-            # Extract the window from the input array
-            window = input_array[tuple(map(slice, start, end))]
-            # Apply the window function to the window and store the result
-            if self.multiprocess:
-                res.append(pool.apply_async(window_func, (window,)))
-            else:
-                res.append(window_func(window))
+    def sample_windows(self, grid_shape):
+        # Optional subsampling
+        # Note, this will result in decreased accuracy
+        if self.subsample is None:
+            return None
+        # Draw the windows to keep up front, so only their sums have to be computed
+        sampled = np.flatnonzero(np.random.random(np.prod(grid_shape)) < self.subsample)
+        return np.unravel_index(sampled, grid_shape)
 
-        # Close the pool and wait for all tasks to complete
-        if self.multiprocess:
-            pool.close()
-            pool.join()
-        # Get the results from the pool
-        results = [r.get() for r in res]
 
-        # split the results into touched, mass and lacunarity
-        touched, mass = zip(*results)
+    def mass_statistics(self, mass, norm, n_touched = None):
+        # A window is touched if it contains any non-zero element, counted from the masses unless given
+        if n_touched is None:
+            n_touched = np.count_nonzero(mass > 0)
 
         # Calculate the N from touched
-        N = np.sum(touched)
-        N = int(N * norm)
+        N = int(n_touched * norm)
 
-        mass = np.array(mass)
-        mass /= np.sum(touched)
         if self.histogram:
+            mass /= n_touched
             p,bins = np.histogram(mass, bins = self.bins, density=False)
             bin_centers = (bins[:-1] + bins[1:]) / 2
-            bin_centers = bin_centers[p != 0]
-            p = p[p != 0]
-            p = p.astype(float)
-            p /= np.sum(p)
         else:
             # If histogram is not enabled, use the unique values of mass as the bins
-            bin_centers, p = np.unique(mass, return_counts=True)
-            bin_centers = bin_centers[p != 0]
-            p = p[p != 0]
-            p = p.astype(float)
-            p /= np.sum(p)
+            if mass.size > 0 and 0 <= np.min(mass) and np.max(mass) <= mass.size and np.all(mass == np.rint(mass)):
+                # Integer masses (e.g. binary inputs) are counted directly, which avoids sorting all the windows
+                p = np.bincount(mass.astype(np.intp))
+                bin_centers = np.arange(len(p)) / n_touched
+            else:
+                mass /= n_touched
+                bin_centers, p = np.unique(mass, return_counts=True)
+
+        return N, moment_lacunarity(p, bin_centers)
+
+
+    def count_statistics(self, counts, norm):
+        """
+        Same as mass_statistics for integer window masses that are already counted
+        :param counts: number of windows of every mass, counts[m] windows have mass m
+        :param norm:
+        :return:
+        """
+        n_touched = np.sum(counts[1:])
+        N = int(n_touched * norm)
+
+        if self.histogram:
+            # Only the masses that occur, so the bins span the same range as for the list of window masses
+            masses = np.flatnonzero(counts)
+            if isinstance(self.bins, str):
+                # The automatic bin width estimators need the individual window masses
+                p, bins = np.histogram(np.repeat(masses / n_touched, counts[masses]), bins = self.bins)
+            else:
+                p, bins = np.histogram(masses / n_touched, bins = self.bins, weights = counts[masses])
+            bin_centers = (bins[:-1] + bins[1:]) / 2
+        else:
+            p = counts
+            bin_centers = np.arange(len(p)) / n_touched
 
-        mean = np.sum(p*bin_centers)
-        var = np.sum(p*(bin_centers - mean)**2)
-        lacunarity = var/mean**2 + 1
+        return N, moment_lacunarity(p, bin_centers)
 
-        return N, lacunarity
+
+    def sliding_window_statistics(self, sat, touched_sat, window_size, step_size):
+        # Get the shape of the input array, the summed-area table is padded by one in every dimension
+        shape = tuple(s - 1 for s in sat.shape)
+        norm = self.normalization(shape, window_size, step_size)
+
+        # Sum every (sampled) window on the grid from the summed-area table
+        grid_shape = window_grid_shape(shape, window_size, step_size)
+        windows = self.sample_windows(grid_shape)
+        out = self.window_buffer(grid_shape) if windows is None else None
+
+        # Floating point window sums of empty regions cancel to about +-1e-7 instead of 0,
+        # so the touched windows are counted exactly from the table of the non-zero mask if there is one
+        n_touched = None
+        if touched_sat is not None:
+            n_touched = np.count_nonzero(box_sums(touched_sat, window_size, step_size, windows, out) > 0)
+
+        mass = box_sums(sat, window_size, step_size, windows, out).ravel()
+
+        return self.mass_statistics(mass, norm, n_touched)
+
+
+    def multilevel_window_statistics(self, levels_array, n_levels, window_size, step_size):
+        # The windows slide over the implicit one-hot array of shape levels_array.shape + (n_levels,)
+        shape = levels_array.shape + (n_levels,)
+        norm = self.normalization(shape, window_size, step_size)
+
+        # The mass of a window along the level axis is the number of voxels in its spatial box
+        # with a level in [level, level + window_size), so one spatial box sum per level window is enough
+        grid_shape = window_grid_shape(levels_array.shape, window_size, step_size)
+        # The masses are counted one level window at a time, so only a single window grid is held in memory.
+        # Every spatial position holds one level, so a window has at most window_size**ndim voxels
+        counts = np.zeros(window_size**levels_array.ndim + 1, dtype=np.int64)
+        for level in range(0, n_levels - window_size + 1, step_size):
+            in_band = (levels_array >= level) & (levels_array < level + window_size)
+            sat = summed_area_table(in_band)
+            # The sums of the boolean band are exact integers, every level window reuses the work buffer
+            windows = self.sample_windows(grid_shape)
+            out = self.window_buffer(grid_shape) if windows is None else None
+            mass = box_sums(sat, window_size, step_size, windows, out)
+            counts += np.bincount(mass.astype(np.intp).ravel(), minlength=len(counts))
+
+        return self.count_statistics(np.trim_zeros(counts, 'b'), norm)
 
 
     def linear_fit(self, scales, vals, invert_scales = True):
-        scales = np.array([np.min(scales[vals == v]) for v in np.unique(vals)])
-        vals = np.unique(vals)
+        vals, scales = smallest_scale_per_value(scales, vals)
         vals = vals[vals > 0]
         scales = scales[:len(vals)]
         if invert_scales:
@@ -136,34 +231,39 @@ class FracND:
         return popt, pcov
 
 
-    def __call__(self,input_array):
-        # TODO: Normalize the input array to [0,1] if it is not already
-        # Check that the input array is empty
-        if np.all(input_array == 0):
-            raise ValueError("The input array is empty. Please provide a non-empty array.")
+    def measure(self, shape, window_statistics, *args):
         # Determine the scales to measure on
         if self.max_box_size is None:
             # Default max size is the largest power of 2 that fits in the smallest dimension of the array:
-            self.max_box_size = int(np.floor(np.log2(np.min(input_array.shape))))
-        self.scales = np.floor(np.logspace(self.max_box_size, self.min_box_size, num=self.n_samples, base=2))
-        self.scales = np.unique(self.scales)  # Remove duplicates that could occur as a result of the floor
-        # Count the number of boxes touched
-        self.Ns = []
-        self.lacunarity_spectrum = []
-
-        # Loop over all scales
-        for scale in tqdm(self.scales):
-            if self.stride is None:
-                # Revert to box counting if stride is not specified
-                step_size = int(scale)
-            else:
-                step_size = int(self.stride)
-            N, lacunarity = self.sliding_window_statistics(input_array, int(scale), step_size)
-            self.Ns.append(N)
-            self.lacunarity_spectrum.append(lacunarity)
+            self.max_box_size = int(np.floor(np.log2(np.min(shape))))
+        # Window sizes are integers, so the geometric grid is rounded to the nearest integer scale
+        # and the duplicates it produces at small scales are only computed once
+        self.scales = np.unique(np.round(np.geomspace(2**self.min_box_size, 2**self.max_box_size, num=self.n_samples))).astype(np.int64)
+        if len(self.scales) < self.n_samples / 2:
+            print(f"Only {len(self.scales)} of the {self.n_samples} scales are distinct window sizes. Consider decreasing n_samples.")
+        if self.stride is None:
+            # Revert to box counting if stride is not specified
+            tasks = [(int(scale), int(scale)) for scale in self.scales]
+        else:
+            tasks = [(int(scale), int(self.stride)) for scale in self.scales]
 
-        self.Ns = np.array(self.Ns)
-        self.lacunarity_spectrum = np.array(self.lacunarity_spectrum)
+        # Count the number of boxes touched and the lacunarity on all scales
+        if self.multiprocess:
+            # The arrays are placed in shared memory once and every worker attaches to them,
+            # the tasks only carry the window and step size
+            shared_args = [_SharedArray(arg) if isinstance(arg, np.ndarray) else arg for arg in args]
+            try:
+                with Pool(initializer=_init_scale_worker, initargs=(window_statistics, shared_args)) as pool:
+                    results = list(tqdm(pool.imap(_scale_task, tasks), total=len(tasks), disable=not self.progress))
+            finally:
+                for arg in shared_args:
+                    if isinstance(arg, _SharedArray):
+                        arg.release()
+        else:
+            results = [window_statistics(*args, window_size, step_size) for window_size, step_size in tqdm(tasks, disable=not self.progress)]
+
+        self.Ns = np.array([N for N, _ in results])
+        self.lacunarity_spectrum = np.array([lacunarity for _, lacunarity in results])
 
         # Fit the FD
         self.popt, self.pcov = self.linear_fit(self.scales, self.Ns)
@@ -173,94 +273,240 @@ class FracND:
         self.LD = self.ls_popt[0]
 
 
+    def __call__(self,input_array):
+        # TODO: Normalize the input array to [0,1] if it is not already
+        # Check that the input array is empty
+        if np.all(input_array == 0):
+            raise ValueError("The input array is empty. Please provide a non-empty array.")
+        # Build the summed-area table once, every window sum is then a fixed number of lookups on all scales
+        sat = summed_area_table(input_array)
+        # The window sums are exact for non-negative integer values, which includes integer-valued floating point
+        # inputs such as segmentations loaded as float32. Other inputs get an exact integer table
+        # of their non-zero mask for counting the touched windows
+        if np.issubdtype(input_array.dtype, np.bool_):
+            exact_sums = True
+        else:
+            exact_sums = np.min(input_array) >= 0 and (np.issubdtype(input_array.dtype, np.integer)
+                                                        or np.array_equal(input_array, np.floor(input_array)))
+        if exact_sums:
+            touched_sat = None
+        else:
+            touched_sat = summed_area_table(input_array > 0)
+        self.measure(input_array.shape, self.sliding_window_statistics, sat, touched_sat)
+
+
+    def call_multilevel(self, input_array, levels = 255):
+        """
+        Same as calling the instance on greyscale_to_binary(input_array, levels), but the one-hot
+        level axis is never materialized, each window is counted from the quantized greyscale levels.
+        :param input_array: greyscale image
+        :param levels:
+        :return:
+        """
+        levels_array = greyscale_to_levels(input_array, levels)
+        n_levels = int(np.max(levels_array)) + 1
+        self.measure(levels_array.shape + (n_levels,), self.multilevel_window_statistics, levels_array, n_levels)
+
+
     def lacunarity_statistics(self):
         return np.min(self.lacunarity_spectrum), np.max(self.lacunarity_spectrum), np.mean(self.lacunarity_spectrum), np.std(self.lacunarity_spectrum)
 
 
-    def plot_FD(self, ci=95, show_plot = True, filename=None):
-        scales = np.array([np.min(self.scales[self.Ns == x]) for x in np.unique(self.Ns)])
-        Ns = np.unique(self.Ns)
-        #Ns = Ns[Ns > 0]
-        #scales = scales[:len(Ns)]
+    def plot_fit(self, x, y, popt, pcov, ci, xlabel, ylabel, label, show_plot, filename):
         # Calculate the confidence intervals
-        slope_err, intercept_err = np.sqrt(np.diag(self.pcov))
+        slope_err, intercept_err = np.sqrt(np.diag(pcov))
         alpha = 1 - ci / 100
-        t_value = t.ppf(1 - alpha / 2, df=len(scales) - 2)
+        t_value = t.ppf(1 - alpha / 2, df=len(x) - 2)
+        # Confidence band of the fitted line from the parameter covariance: var(y) = x^2 var(a) + 2x cov(a,b) + var(b)
+        line_x = np.linspace(np.min(x), np.max(x), 100)
+        line_y = popt[0]*line_x + popt[1]
+        band = t_value*np.sqrt(line_x**2*pcov[0, 0] + 2*line_x*pcov[0, 1] + pcov[1, 1])
         slope_err *= t_value
         intercept_err *= t_value
-        fig, ax = plt.subplots(figsize = (8,6))
-        sns.regplot(x=np.log(1/scales), y=np.log(Ns), ci=ci,
-                    line_kws={'color': 'black', 'linestyle': '--', 'label': "y={0:.3f}±{1:.3f}x+{2:.3f}±{3:.3f}".format(self.popt[0], slope_err, self.popt[1], intercept_err)},
-                    scatter_kws={'color': 'teal', 'label': 'Measured ratios'},
-                    ax=ax)
-        ax.scatter(np.log(1/scales), np.log(Ns), c = "teal", label = "Measured ratios")
-        ax.set_ylabel("$\log N(\epsilon)$")
-        ax.set_xlabel("$\log 1/ \epsilon$")
-        plt.grid(True)
+        if show_plot:
+            fig, ax = plt.subplots(figsize = (8,6))
+        else:
+            # Render off-screen without pyplot's figure manager, so there is no figure left to close
+            fig = Figure(figsize = (8,6))
+            ax = fig.add_subplot()
+        ax.plot(line_x, line_y, color='black', linestyle='--',
+                label="y={0:.3f}±{1:.3f}x+{2:.3f}±{3:.3f}".format(popt[0], slope_err, popt[1], intercept_err))
+        ax.fill_between(line_x, line_y - band, line_y + band, color='black', alpha=0.15, linewidth=0)
+        ax.scatter(x, y, c = "teal", label = label)
+        ax.set_ylabel(ylabel)
+        ax.set_xlabel(xlabel)
+        ax.grid(True)
         ax.legend()
+        if filename is not None:
+            fig.savefig(filename)
         if show_plot:
             plt.show()
-        if filename is not None:
-            plt.savefig(filename)
-        if show_plot == False and filename is None:
-            plt.close()
+
+
+    def plot_FD(self, ci=95, show_plot = True, filename=None):
+        Ns, scales = smallest_scale_per_value(self.scales, self.Ns)
+        #Ns = Ns[Ns > 0]
+        #scales = scales[:len(Ns)]
+        self.plot_fit(np.log(1/scales), np.log(Ns), self.popt, self.pcov, ci,
+                      r"$\log 1/ \epsilon$", r"$\log N(\epsilon)$", "Measured ratios", show_plot, filename)
 
 
     def plot_lacunarity(self, ci = 95, show_plot = True, filename=None):
-        scales = np.array([np.min(self.scales[self.lacunarity_spectrum == x]) for x in np.unique(self.lacunarity_spectrum)])
-        lacunarity_spectrum = np.unique(self.lacunarity_spectrum)
+        lacunarity_spectrum, scales = smallest_scale_per_value(self.scales, self.lacunarity_spectrum)
         lacunarity_spectrum = lacunarity_spectrum[lacunarity_spectrum > 0]
         scales = scales[:len(lacunarity_spectrum)]
-        # Calculate the confidence intervals
-        slope_err, intercept_err = np.sqrt(np.diag(self.pcov))
-        alpha = 1 - ci / 100
-        t_value = t.ppf(1 - alpha / 2, df=len(scales) - 2)
-        slope_err *= t_value
-        intercept_err *= t_value
-        fig, ax = plt.subplots(figsize = (8,6))
-        sns.regplot(x=np.log(scales), y=np.log(lacunarity_spectrum), ci=ci,
-                    line_kws={'color': 'black', 'linestyle': '--', 'label': "y={0:.3f}±{1:.3f}x+{2:.3f}±{3:.3f}".format(self.ls_popt[0], slope_err, self.ls_popt[1], intercept_err)},
-                    scatter_kws={'color': 'teal', 'label': 'Measured ratios'},
-                    ax=ax)
-        ax.scatter(np.log(scales), np.log(lacunarity_spectrum), c = "teal", label = "Lacunarity")
-        ax.set_ylabel("$\log \lambda(\epsilon)$")
-        ax.set_xlabel("$\log \epsilon$")
-        plt.grid(True)
-        plt.legend()
-        if show_plot:
-            plt.show()
-        if filename is not None:
-            plt.savefig(filename)
-        if show_plot == False and filename is None:
-            plt.close()
+        self.plot_fit(np.log(scales), np.log(lacunarity_spectrum), self.ls_popt, self.ls_pcov, ci,
+                      r"$\log \epsilon$", r"$\log \lambda(\epsilon)$", "Lacunarity", show_plot, filename)
 
 
-def greyscale_to_binary(array, levels = 255):
+def smallest_scale_per_value(scales, vals):
     """
-    Converts a greyscale image to a binary image by adding a new dimension to the array
+    Groups the measurements by value and keeps the smallest scale of each group with a single sort
+    :param scales:
+    :param vals:
+    :return: the sorted unique values and the smallest scale belonging to each of them
+    """
+    # Sort by value first and by scale second, so the first element of each group has the smallest scale
+    order = np.lexsort((scales, vals))
+    unique_vals, first = np.unique(vals[order], return_index=True)
+    return unique_vals, scales[order][first]
+
+
+def moment_lacunarity(p, bin_centers):
+    """
+    Lacunarity from the raw moments of a mass distribution in a single sweep over the bins:
+    var/mean**2 + 1 = E[M^2]/E[M]^2, empty bins have zero weight so they need no filtering
+    :param p: number of windows in every bin
+    :param bin_centers: mass of every bin
+    :return:
+    """
+    s0 = np.sum(p)
+    s1 = np.einsum('i,i->', p, bin_centers)
+    s2 = np.einsum('i,i,i->', p, bin_centers, bin_centers)
+    return s0*s2/s1**2
+
+
+def summed_area_table(array):
+    """
+    Computes the summed-area table (integral image) of an N dimensional array.
+    The table is padded with a leading zero plane in every dimension, so that box sums need no edge cases.
+    Integer and boolean inputs are accumulated exactly in int64.
     :param array:
-    :param levels:
     :return:
     """
-    array = (array - np.min(array)) / (np.max(array) - np.min(array))
-    array = (array * levels).astype(int)
+    if np.issubdtype(array.dtype, np.integer) or np.issubdtype(array.dtype, np.bool_):
+        dtype = np.int64
+    else:
+        dtype = np.float64
+    sat = np.zeros(tuple(s + 1 for s in array.shape), dtype=dtype)
+    sat[(slice(1, None),) * array.ndim] = array
+    for axis in range(array.ndim):
+        np.cumsum(sat, axis=axis, out=sat)
+    return sat
+
+
+if NUMBA_AVAILABLE:
+    # Single threaded on purpose, the scales are already spread over worker processes and
+    # numba's threading layers are not safe to fork once they have been started.
+    # The signatures of the integer and floating point summed-area tables are compiled eagerly at import
+    # and cached on disk, so worker processes load the machine code instead of compiling on first call.
+    @njit(['void(int64[:, :, ::1], int64, int64, float64[:, :, ::1])',
+           'void(float64[:, :, ::1], int64, int64, float64[:, :, ::1])'],
+          fastmath=True, cache=True)
+    def _box_sums_3d(sat, window_size, step_size, out):
+        # Eight corner lookups per window in a single pass over the window grid
+        nx, ny, nz = out.shape
+        for ix in range(nx):
+            x0 = ix * step_size
+            x1 = x0 + window_size
+            for iy in range(ny):
+                y0 = iy * step_size
+                y1 = y0 + window_size
+                for iz in range(nz):
+                    z0 = iz * step_size
+                    z1 = z0 + window_size
+                    out[ix, iy, iz] = (sat[x1, y1, z1] - sat[x0, y1, z1] - sat[x1, y0, z1] - sat[x1, y1, z0]
+                                       + sat[x0, y0, z1] + sat[x0, y1, z0] + sat[x1, y0, z0] - sat[x0, y0, z0])
+
+
+def window_grid_shape(shape, window_size, step_size):
+    """
+    Number of sliding windows along each dimension of an array
+    :param shape:
+    :param window_size:
+    :param step_size:
+    :return:
+    """
+    return tuple((s - window_size) // step_size + 1 for s in shape)
+
+
+def box_sums(sat, window_size, step_size, windows = None, out = None):
+    """
+    Sums the windows of a sliding window grid with inclusion-exclusion over the 2^N corners of each box
+    :param sat: summed-area table obtained from summed_area_table
+    :param window_size:
+    :param step_size:
+    :param windows: optional tuple of window grid index arrays (as returned by np.unravel_index), only these windows are summed
+    :param out: optional C-contiguous float64 array of the full window grid shape to write the sums into, ignored if windows is given
+    :return: array of the window sums with one axis per dimension, or one sum per window if windows is given
+    """
+    ndim = sat.ndim
+    if windows is not None:
+        # Start index of the selected windows along each dimension
+        starts = [index * step_size for index in windows]
+        mass = np.zeros(len(starts[0]), dtype=np.float64)
+    else:
+        # Start index of every window along each dimension
+        starts = [np.arange(0, s - window_size, step_size) for s in sat.shape]
+        if out is None:
+            out = np.empty(tuple(len(start) for start in starts), dtype=np.float64)
+        if NUMBA_AVAILABLE and ndim == 3:
+            _box_sums_3d(sat, window_size, step_size, out)
+            return out
+        mass = out
+        mass.fill(0)
+    for corner in itertools.product((0, window_size), repeat=ndim):
+        index = [start + offset for start, offset in zip(starts, corner)]
+        # Selected windows are gathered pointwise, the full grid is the outer product of the start indices
+        values = sat[tuple(index)] if windows is not None else sat[np.ix_(*index)]
+        if (ndim - np.count_nonzero(corner)) % 2 == 0:
+            mass += values
+        else:
+            mass -= values
+    return mass
 
-    array_shape = array.shape
-    max_pixel_value = np.max(array)
 
-    # Calculate the new shape for the binary array
-    binary_shape = array_shape + (max_pixel_value + 1,)
+def greyscale_to_levels(array, levels = 255):
+    """
+    Rescales a greyscale image to integer levels between 0 and levels
+    :param array:
+    :param levels:
+    :return: array of the smallest unsigned integer type holding levels
+    """
+    min_value, max_value = np.min(array), np.max(array)
+
+    # Rescale in a single float buffer instead of allocating a new array for every operation
+    scaled = np.subtract(array, min_value, dtype=np.float64)
+    scaled /= max_value - min_value
+    scaled *= levels
+    return scaled.astype(np.min_scalar_type(levels))
 
-    # Create a binary array with the new shape
-    binary_array = np.zeros(binary_shape, dtype=np.uint8)
 
-    # Set the corresponding element to 1 based on the pixel value in the original image
-    indices = np.indices(array_shape)
-    indices_flat = indices.reshape(len(array_shape), -1)
+def greyscale_to_binary(array, levels = 255):
+    """
+    Converts a greyscale image to a binary image by adding a new dimension to the array
+    :param array:
+    :param levels:
+    :return:
+    """
+    array = greyscale_to_levels(array, levels)
+    # The levels are stored in the smallest unsigned type, so the level count is taken as a Python int
+    # to keep max + 1 from wrapping around (np.uint8(255) + 1 == 0)
+    max_pixel_value = int(np.max(array))
 
-    pixel_values = array[tuple(indices_flat)]
-    binary_indices = tuple(np.concatenate((indices_flat, pixel_values[np.newaxis]), axis=0))
-    binary_array[binary_indices] = 1
+    # Set the element of the new level axis corresponding to the pixel value in the original image,
+    # the boolean comparison is reinterpreted as uint8 without a copy
+    binary_array = (array[..., np.newaxis] == np.arange(max_pixel_value + 1)).view(np.uint8)
 
     return binary_array
 
@@ -272,11 +518,17 @@ def crop_segmentation(array, return_indices = False):
     :param return_indices:
     :return:
     '''
-    # Get the indices of non-zero elements
-    nonzero = np.nonzero(array)
-    # Get the minimum and maximum indices in each dimension
-    minima = np.min(nonzero, axis=1)
-    maxima = np.max(nonzero, axis=1) + 1  # We add 1 because Python slices are exclusive at the top
+    # Project the non-zero mask onto each axis instead of extracting the coordinates of every non-zero element
+    nonzero = array != 0
+    minima = np.empty(array.ndim, dtype=np.intp)
+    maxima = np.empty(array.ndim, dtype=np.intp)
+    for axis in range(array.ndim):
+        occupied = np.flatnonzero(nonzero.any(axis=tuple(a for a in range(array.ndim) if a != axis)))
+        if occupied.size == 0:
+            raise ValueError("The input array is empty. Please provide a non-empty array.")
+        # Get the minimum and maximum indices in this dimension
+        minima[axis] = occupied[0]
+        maxima[axis] = occupied[-1] + 1  # We add 1 because Python slices are exclusive at the top
     cropped_array = array[minima[0]:maxima[0], minima[1]:maxima[1], minima[2]:maxima[2]]
     if return_indices:
         return cropped_array, minima, maxima
@@ -23,16 +23,6 @@ Quick usage:
     summary = analyze_dataset('input_data/', 'fractal_results/')
 """
 
-from .analyzer import (
-    analyze_patient_folder,
-    batch_analyze_dataset,
-    analyze_segmentation_fractal_dimension,
-    analyze_intensity_lacunarity,
-    analyze_patient,
-    analyze_dataset,
-    FractalConfig
-)
-
 __version__ = "1.0.0"
 __author__ = "Medical Imaging Tools"
 
@@ -46,3 +36,12 @@ __all__ = [
     'analyze_intensity_lacunarity',
     'FractalConfig'
 ]
+
+
+def __getattr__(name):
+    # The public API is imported from the analyzer module on first use, so importing the package
+    # (e.g. to run fractal_analysis.cli) doesn't load numpy, nibabel and matplotlib up front
+    if name in __all__:
+        from . import analyzer
+        return getattr(analyzer, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -9,17 +9,19 @@ Separates fractal dimension analysis (on segmentations) from lacunarity analysis
 
 import os
 import sys
+import copy
 import numpy as np
 import pandas as pd
 import nibabel as nib
 import matplotlib.pyplot as plt
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import logging
 
 # Import FracND library (assumes fracnd.py is available)
 try:
-    from fracnd import FracND, greyscale_to_binary, crop_segmentation, crop_image
+    from fracnd import FracND, crop_segmentation, crop_image
     FRACND_AVAILABLE = True
 except ImportError:
     FRACND_AVAILABLE = False
@@ -40,6 +42,11 @@ class FractalConfig:
         # Greyscale conversion
         self.intensity_levels = 255
         
+        # Parallel processing
+        self.multiprocess = True  # Spread the scales of each FracND calculation over processes
+        self.n_workers = None  # Patients analyzed in parallel in batch mode (None = CPU count)
+        self.progress = True  # Per-scale progress bar of each FracND calculation
+        
         # Output options
         self.save_plots = True
         self.plot_format = 'png'
@@ -62,10 +69,11 @@ def load_and_prepare_segmentation(seg_file):
         seg_file: Path to segmentation file
         
     Returns:
-        tuple: (cropped_seg, minima, maxima) for cropping other images
+        tuple: (cropped_seg, minima, maxima) with cropping indices for other images
     """
     seg = nib.load(seg_file)
-    seg_data = seg.get_fdata()
+    # Segmentations only hold small integer labels, float32 represents them exactly
+    seg_data = seg.get_fdata(dtype=np.float32)
     
     # Handle 4D data
     if len(seg_data.shape) == 4:
@@ -101,7 +109,9 @@ def analyze_segmentation_fractal_dimension(seg_data, config=None, patient_id=Non
     fractal_calculator = FracND(
         n_samples=config.n_samples,
         stride=config.stride,
-        subsample=config.subsample  # No subsampling for segmentation
+        subsample=config.subsample,  # No subsampling for segmentation
+        multiprocess=config.multiprocess,
+        progress=config.progress
     )
     
     # Perform analysis
@@ -131,14 +141,14 @@ def analyze_segmentation_fractal_dimension(seg_data, config=None, patient_id=Non
     return results
 
 
-def analyze_intensity_lacunarity(image_data, seg_data, minima, maxima, modality, 
+def analyze_intensity_lacunarity(image_data, cropped_seg, minima, maxima, modality, 
                                 config=None, patient_id=None, output_folder=None):
     """
     Analyze lacunarity of image intensities within segmented region.
     
     Args:
         image_data: Image intensity array
-        seg_data: Segmentation mask (uncropped)
+        cropped_seg: Segmentation mask cropped to its bounding box
         minima, maxima: Cropping indices from segmentation
         modality: Modality name (e.g., 't1ce', 't2')
         config: FractalConfig object
@@ -162,24 +172,21 @@ def analyze_intensity_lacunarity(image_data, seg_data, minima, maxima, modality,
     # Crop image to same region as segmentation
     cropped_image = crop_image(image_data, minima, maxima)
     
-    # Crop segmentation for masking
-    cropped_seg, _, _ = crop_segmentation(seg_data)
-    
     # Mask image with segmentation
     masked_image = cropped_image * cropped_seg
     
-    # Convert to binary representation for fractal analysis
-    binary_image = greyscale_to_binary(masked_image, levels=config.intensity_levels)
-    
     # Initialize fractal calculator for intensity analysis
     fractal_calculator = FracND(
         n_samples=config.n_samples,
         stride=config.stride,
-        subsample=config.subsample_intensity  # Heavy subsampling for efficiency
+        subsample=config.subsample_intensity,  # Heavy subsampling for efficiency
+        multiprocess=config.multiprocess,
+        progress=config.progress
     )
     
-    # Perform analysis
-    fractal_calculator(binary_image)
+    # Perform analysis on the binary (one-hot) representation of the intensity levels,
+    # counted directly from the levels instead of materializing the one-hot array
+    fractal_calculator.call_multilevel(masked_image, levels=config.intensity_levels)
     
     # Extract results (focus on lacunarity)
     results = {
@@ -238,7 +245,7 @@ def analyze_patient_folder(patient_folder, modalities=None, config=None, output_
     seg_file = seg_files[0]
     logger.info(f"Using segmentation: {seg_file.name}")
     
-    # Load and prepare segmentation
+    # Load and prepare segmentation, the cropped segmentation is reused for masking every modality
     cropped_seg, minima, maxima = load_and_prepare_segmentation(seg_file)
     
     # Analyze segmentation fractal dimension
@@ -269,13 +276,9 @@ def analyze_patient_folder(patient_folder, modalities=None, config=None, output_
             img = nib.load(modality_file)
             img_data = img.get_fdata()
             
-            # Load full segmentation for masking
-            seg = nib.load(seg_file)
-            seg_data = seg.get_fdata()
-            
             # Analyze lacunarity
             modality_results = analyze_intensity_lacunarity(
-                img_data, seg_data, minima, maxima, modality,
+                img_data, cropped_seg, minima, maxima, modality,
                 config, patient_id, output_folder
             )
             
@@ -322,11 +325,17 @@ def batch_analyze_dataset(input_folder, output_folder, modalities=None, config=N
     
     # Initialize or load existing results
     results_file = output_path / 'fractal_analysis_results.csv'
+    columns = ['patient_id', 'seg_FD', 'seg_LD'] + [f'{mod}_LD' for mod in modalities]
     if results_file.exists():
-        df_main = pd.read_csv(results_file)
+        df_existing = pd.read_csv(results_file)
+        columns = list(df_existing.columns) + [col for col in columns if col not in df_existing.columns]
+        df_existing = df_existing.reindex(columns=columns)
     else:
-        columns = ['patient_id', 'seg_FD', 'seg_LD'] + [f'{mod}_LD' for mod in modalities]
-        df_main = pd.DataFrame(columns=columns)
+        df_existing = pd.DataFrame(columns=columns)
+    
+    # Write the header (and any existing rows) once, new rows are appended as patients finish
+    if save_intermediate:
+        df_existing.to_csv(results_file, index=False)
     
     # Create plots directory
     plots_dir = output_path / 'plots'
@@ -335,47 +344,69 @@ def batch_analyze_dataset(input_folder, output_folder, modalities=None, config=N
     successful = 0
     failed = 0
     all_results = []
+    rows = []
+    
+    # Patients are independent, so they are analyzed in parallel. Every worker already keeps
+    # a core busy, the scales within a patient are therefore computed without a nested pool.
+    n_workers = config.n_workers or os.cpu_count()
+    worker_config = copy.copy(config)
+    worker_config.multiprocess = config.multiprocess and n_workers == 1
+    # Only the patient bar is drawn, the per-scale bars of the workers would write over it and each other
+    worker_config.progress = False
     
     # Process patients
-    for i, patient_folder in enumerate(tqdm(patient_folders[start_from:], 
-                                          desc="Analyzing patients")):
-        try:
-            results = analyze_patient_folder(
-                patient_folder, modalities, config, plots_dir
-            )
-            
-            # Extract data for CSV
-            row_data = {
-                'patient_id': results['patient_id'],
-                'seg_FD': results['segmentation']['FD'],
-                'seg_LD': results['segmentation']['LD']
-            }
-            
-            # Add modality lacunarity values
-            for modality in modalities:
-                if modality in results['modalities']:
-                    if 'error' not in results['modalities'][modality]:
-                        row_data[f'{modality}_LD'] = results['modalities'][modality]['LD']
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(analyze_patient_folder, patient_folder, modalities, worker_config, plots_dir): i
+            for i, patient_folder in enumerate(patient_folders[start_from:], start=start_from)
+        }
+        
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Analyzing patients"):
+            index = futures[future]
+            patient_folder = patient_folders[index]
+            try:
+                results = future.result()
+                
+                # Extract data for CSV
+                row_data = {
+                    'patient_id': results['patient_id'],
+                    'seg_FD': results['segmentation']['FD'],
+                    'seg_LD': results['segmentation']['LD']
+                }
+                
+                # Add modality lacunarity values
+                for modality in modalities:
+                    if modality in results['modalities']:
+                        if 'error' not in results['modalities'][modality]:
+                            row_data[f'{modality}_LD'] = results['modalities'][modality]['LD']
+                        else:
+                            row_data[f'{modality}_LD'] = np.nan
                     else:
                         row_data[f'{modality}_LD'] = np.nan
-                else:
-                    row_data[f'{modality}_LD'] = np.nan
-            
-            # Add to dataframe
-            df_main = pd.concat([df_main, pd.DataFrame([row_data])], ignore_index=True)
-            
-            # Save intermediate results
-            if save_intermediate:
-                df_main.to_csv(results_file, index=False)
-            
-            all_results.append(results)
-            successful += 1
-            
-        except Exception as e:
-            logger.error(f"Failed to analyze {patient_folder.name}: {e}")
-            failed += 1
-    
-    # Save final results
+                
+                rows.append((index, row_data))
+                
+                # Save intermediate results by appending the new row only
+                if save_intermediate:
+                    pd.DataFrame([row_data], columns=columns).to_csv(
+                        results_file, mode='a', header=False, index=False
+                    )
+                
+                all_results.append((index, results))
+                successful += 1
+                
+            except Exception as e:
+                logger.error(f"Failed to analyze {patient_folder.name}: {e}")
+                failed += 1
+    
+    # Patients finish in any order, restore the order of the patient folders
+    rows = [row_data for _, row_data in sorted(rows, key=lambda item: item[0])]
+    all_results = [results for _, results in sorted(all_results, key=lambda item: item[0])]
+    
+    # Save final results, the new rows are concatenated to the existing ones once
+    df_main = pd.DataFrame(rows, columns=columns)
+    if not df_existing.empty:
+        df_main = pd.concat([df_existing, df_main], ignore_index=True)
     df_main.to_csv(results_file, index=False)
     
     summary = {
@@ -12,12 +12,6 @@ import sys
 import logging
 from pathlib import Path
 
-from .analyzer import (
-    analyze_patient_folder,
-    batch_analyze_dataset,
-    FractalConfig
-)
-
 
 def setup_logging(verbose=False, quiet=False):
     """Setup logging configuration."""
@@ -34,6 +28,16 @@ def setup_logging(verbose=False, quiet=False):
     )
 
 
+def _existing_dir(value):
+    """Argparse type for an existing directory."""
+    path = Path(value)
+    if not path.exists():
+        raise argparse.ArgumentTypeError(f"folder does not exist: {value}")
+    if not path.is_dir():
+        raise argparse.ArgumentTypeError(f"not a directory: {value}")
+    return path
+
+
 def create_parser():
     """Create command-line argument parser."""
     parser = argparse.ArgumentParser(
@@ -55,6 +59,9 @@ Examples:
   
   # Resume dataset analysis from patient 10
   python -m fractal_analysis.cli --dataset data/ -o results/ --start-from 10
+  
+  # Analyze 4 patients in parallel
+  python -m fractal_analysis.cli --dataset data/ -o results/ --workers 4
         """
     )
     
@@ -63,11 +70,13 @@ Examples:
     
     input_group.add_argument(
         '--patient',
+        type=_existing_dir,
         help='Single patient folder to analyze'
     )
     
     input_group.add_argument(
         '--dataset',
+        type=_existing_dir,
         help='Dataset folder containing multiple patients'
     )
     
@@ -123,6 +132,13 @@ Examples:
         help='Patient index to start from (for resuming dataset analysis)'
     )
     
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of patients analyzed in parallel (default: number of CPU cores)'
+    )
+    
     parser.add_argument(
         '--no-intermediate-save',
         action='store_true',
@@ -163,21 +179,6 @@ def validate_args(args):
     """Validate command-line arguments."""
     errors = []
     
-    # Check input paths
-    if args.patient:
-        patient_path = Path(args.patient)
-        if not patient_path.exists():
-            errors.append(f"Patient folder does not exist: {args.patient}")
-        elif not patient_path.is_dir():
-            errors.append(f"Patient path is not a directory: {args.patient}")
-    
-    elif args.dataset:
-        dataset_path = Path(args.dataset)
-        if not dataset_path.exists():
-            errors.append(f"Dataset folder does not exist: {args.dataset}")
-        elif not dataset_path.is_dir():
-            errors.append(f"Dataset path is not a directory: {args.dataset}")
-    
     # Check for reasonable parameter values
     if args.n_samples < 10:
         errors.append("Number of samples should be at least 10")
@@ -191,6 +192,9 @@ def validate_args(args):
     if args.start_from < 0:
         errors.append("Start-from index must be non-negative")
     
+    if args.workers is not None and args.workers < 1:
+        errors.append("Number of workers must be at least 1")
+    
     return errors
 
 
@@ -210,6 +214,10 @@ def main():
             print(f"Error: {error}")
         return 1
     
+    # The analyzer is only imported once the arguments are valid, so --help and argument
+    # errors don't wait for numpy, nibabel and matplotlib to load
+    from .analyzer import analyze_patient_folder, batch_analyze_dataset, FractalConfig
+    
     # Check FracND availability
     try:
         from .analyzer import validate_fracnd
@@ -225,6 +233,7 @@ def main():
     config.stride = args.stride
     config.subsample_intensity = args.subsample_intensity
     config.intensity_levels = args.intensity_levels
+    config.n_workers = args.workers
     config.save_plots = not args.no_plots
     config.plot_format = args.plot_format
     
@@ -15,15 +15,6 @@ Quick usage:
     summary = convert_folder('input_folder/', 'output_folder/')
 """
 
-from .converter import (
-    convert_nii_file,
-    convert_directory,
-    convert_file,
-    convert_folder,
-    fix_signed_array,
-    fix_header_and_affine_issues
-)
-
 __version__ = "1.0.0"
 __author__ = "Medical Imaging Tools"
 
@@ -36,3 +27,11 @@ __all__ = [
     'fix_signed_array',
     'fix_header_and_affine_issues'
 ]
+
+
+def __getattr__(name):
+    # Resolve the converter functions lazily, nibabel is only loaded once one of them is used
+    if name in __all__:
+        from . import converter
+        return getattr(converter, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -11,8 +11,6 @@ import sys
 import logging
 from pathlib import Path
 
-from .converter import convert_nii_file, convert_directory
-
 
 def setup_logging(verbose=False):
     """Setup basic logging."""
@@ -23,6 +21,14 @@ def setup_logging(verbose=False):
     )
 
 
+def _existing_path(value):
+    """Argparse type for an existing file or directory."""
+    path = Path(value)
+    if not path.exists():
+        raise argparse.ArgumentTypeError(f"no such file or directory: {value}")
+    return path
+
+
 def create_parser():
     """Create command-line argument parser."""
     parser = argparse.ArgumentParser(
@@ -35,10 +41,11 @@ Examples:
   python -m nii_converter.cli input/ output/              # Convert with different output folder
   python -m nii_converter.cli input/ --no-recursive       # Don't search subdirectories
   python -m nii_converter.cli data.nii -v                 # Verbose output
+  python -m nii_converter.cli input/ -w $(nproc)          # Convert files on all CPU cores
         """
     )
     
-    parser.add_argument('input', help='Input .nii file or directory')
+    parser.add_argument('input', type=_existing_path, help='Input .nii file or directory')
     parser.add_argument('output', nargs='?', help='Output .nii.gz file or directory (optional)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
     parser.add_argument('--no-recursive', action='store_true', help='Don\'t search subdirectories')
@@ -46,6 +53,12 @@ Examples:
     parser.add_argument('--offset', type=float, default=32768.0, 
                        help='Offset for signed array correction (default: 32768)')
     parser.add_argument('--no-progress', action='store_true', help='Disable progress bar')
+    parser.add_argument('--log-interval', type=int, metavar='N',
+                       help='Log progress every N files when no progress bar is shown')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                       help='Number of files converted in parallel (default: 1)')
+    parser.add_argument('--compress-level', type=int, default=1, choices=range(1, 10), metavar='{1-9}',
+                       help='Gzip compression level (default: 1)')
     
     return parser
 
@@ -58,7 +71,13 @@ def main():
     # Setup logging
     setup_logging(args.verbose)
     
-    input_path = Path(args.input)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    
+    # Deferred until the arguments are parsed, nibabel is not needed for --help or usage errors
+    from .converter import convert_nii_file, convert_directory
+    
+    input_path = args.input
     
     try:
         if input_path.is_file():
@@ -67,7 +86,8 @@ def main():
                 input_path, 
                 args.output, 
                 check_existing=not args.overwrite,
-                offset=args.offset
+                offset=args.offset,
+                compress_level=args.compress_level
             )
             
             if result['success']:
@@ -91,7 +111,10 @@ def main():
                 recursive=not args.no_recursive,
                 offset=args.offset,
                 overwrite=args.overwrite,
-                show_progress=not args.no_progress
+                show_progress=not args.no_progress,
+                workers=args.workers,
+                compress_level=args.compress_level,
+                log_interval=args.log_interval
             )
             
             print(f"\nConversion Summary:")
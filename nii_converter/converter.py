@@ -6,14 +6,52 @@ fixes for common issues, especially from ImageJ exports. Includes proper affine
 matrix scaling for unit conversions.
 """
 import os
+import sys
+import gzip
+import shutil
 import nibabel as nib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from tqdm import tqdm
 import logging
 
 logger = logging.getLogger(__name__)
 
+# ISA-L is optional, it provides a much faster DEFLATE for writing .nii.gz files
+try:
+    from isal import igzip, isal_zlib
+    ISAL_AVAILABLE = True
+except ImportError:
+    ISAL_AVAILABLE = False
+
+# Buffer size of the compressed output file, so the compressor output reaches the disk in few large writes
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+@contextmanager
+def open_gzip_output(path, compress_level=1):
+    """
+    Open a gzip file for writing, using ISA-L when it is installed and supports the level.
+    
+    Args:
+        path: output file path
+        compress_level: gzip compression level (1-9)
+        
+    Yields:
+        writable gzip file object
+    """
+    with open(path, 'wb', buffering=WRITE_BUFFER_SIZE) as raw_file:
+        # mtime is fixed like in nibabel, so converting the same file twice gives identical output
+        if ISAL_AVAILABLE and compress_level <= isal_zlib.ISAL_BEST_COMPRESSION:
+            gz_file = igzip.IGzipFile(mode='wb', compresslevel=compress_level, fileobj=raw_file, mtime=0)
+        else:
+            gz_file = gzip.GzipFile(mode='wb', compresslevel=compress_level, fileobj=raw_file, mtime=0)
+        with gz_file:
+            yield gz_file
+
 def fix_signed_array(data, offset=32768.0):
     """
     Fix signed arrays by adding offset if minimum value is negative.
@@ -23,69 +61,141 @@ def fix_signed_array(data, offset=32768.0):
         offset: offset to add to negative arrays
         
     Returns:
-        Fixed array
+        tuple: (fixed_array, original_min) where original_min is 0 for unsigned
+        integer data, which cannot be negative and is not scanned
     """
-    if np.min(data) < 0:
-        logger.info(f"Signed array detected (min: {np.min(data):.1f}), applying offset +{offset}")
-        return data + offset
-    return data
+    if np.issubdtype(data.dtype, np.unsignedinteger):
+        return data, 0
+    
+    original_min = np.min(data)
+    if original_min < 0:
+        logger.info(f"Signed array detected (min: {original_min:.1f}), applying offset +{offset}")
+        # A fractional offset can't be added exactly in integer arithmetic, it takes the float path below
+        if np.issubdtype(data.dtype, np.integer) and float(offset).is_integer():
+            if (original_min + offset >= 0
+                    and np.iinfo(data.dtype).max + offset <= np.iinfo(np.uint32).max):
+                # The shifted values fit the uint32 output type. Casting wraps the negative values around
+                # and the in-place add wraps them back, so no widened or float64 intermediate is needed
+                fixed = data.astype(np.uint32)
+                fixed += np.uint32(offset)
+                return fixed, original_min
+            # Otherwise widen the data so the offset fits and add it in place, instead of upcasting to float64
+            data = data.astype(np.int32 if data.dtype.itemsize < 4 else np.int64)
+            np.add(data, int(offset), out=data)
+            return data, original_min
+        # Floating point data keeps double precision, the offset is far larger than its fractional part
+        return np.add(data, offset, dtype=np.float64), original_min
+    return data, original_min
 
-def fix_header_and_affine_issues(header, affine):
+@dataclass(frozen=True)
+class FixPlan:
+    """Header and affine fixes decided for one combination of voxel size and units."""
+    affine_scale: float = 1.0
+    new_zooms: tuple = None
+    new_units: tuple = None
+    fixes_applied: tuple = ()
+    messages: tuple = ()
+
+@lru_cache(maxsize=64)
+def _decide_fixes(zooms, xyzt_units):
     """
-    Fix common header and affine issues from ImageJ exports.
+    Decide which header and affine fixes apply to a voxel size and unit combination.
+    
+    Files from the same export pipeline share these, so the decision is cached.
     
     Args:
-        header: nibabel header object
-        affine: nibabel affine matrix
+        zooms: tuple of voxel sizes from the header
+        xyzt_units: tuple of (spatial_units, temporal_units) from the header
         
     Returns:
-        tuple: (fixed_header, fixed_affine, list_of_fixes_applied)
+        FixPlan with the fixes to apply
     """
     fixes_applied = []
-    affine = affine.copy()  # Don't modify the original
-    
-    # Fix data type to uint32
-    header.set_data_dtype(np.uint32)
+    messages = []
+    affine_scale = 1.0
+    new_units = None
     
     # Get voxel size and units
-    voxel_size = np.array(header.get_zooms())
-    spatial_units, temporal_units = header.get_xyzt_units()
+    voxel_size = np.array(zooms)
+    spatial_units, temporal_units = xyzt_units
     
     # Fix unit conversion (micron to mm)
     if spatial_units == 'micron':
         voxel_size[:3] = voxel_size[:3] / 1000
-        header.set_zooms(voxel_size)
-        header.set_xyzt_units('mm', temporal_units)
+        new_units = ('mm', temporal_units)
         # CRITICAL: Also scale the affine matrix
-        affine[:3, :] /= 1000
+        affine_scale = 0.001
         fixes_applied.append("converted_units_micron_to_mm")
-        logger.info("Converted voxel units from micron to mm and scaled affine matrix")
+        messages.append("Converted voxel units from micron to mm and scaled affine matrix")
     elif spatial_units != 'mm' and spatial_units != 'unknown':
         # Check if the voxel size suggests microns (typically > 100)
         if np.any(voxel_size[:3] > 100):
             voxel_size[:3] = voxel_size[:3] / 1000
-            header.set_zooms(voxel_size)
-            header.set_xyzt_units('mm', temporal_units)
+            new_units = ('mm', temporal_units)
             # Scale the affine matrix
-            affine[:3, :] /= 1000
+            affine_scale = 0.001
             fixes_applied.append("converted_units_assumed_micron_to_mm")
-            logger.info(f"Converted voxel units from {spatial_units} to mm (assumed microns) and scaled affine matrix")
+            messages.append(f"Converted voxel units from {spatial_units} to mm (assumed microns) and scaled affine matrix")
         else:
-            header.set_xyzt_units('mm', temporal_units)
+            new_units = ('mm', temporal_units)
             fixes_applied.append("set_units_to_mm")
-            logger.info(f"Set spatial units to mm (was {spatial_units})")
+            messages.append(f"Set spatial units to mm (was {spatial_units})")
     
     # Fix temporal voxel size if it's not 0
-    voxel_size = np.array(header.get_zooms())
     if len(voxel_size) > 3 and voxel_size[3] != 0:
         voxel_size[3] = 0
-        header.set_zooms(voxel_size)
         fixes_applied.append("fixed_temporal_voxel_size")
-        logger.info("Set temporal voxel size to 0")
+        messages.append("Set temporal voxel size to 0")
+    
+    new_zooms = tuple(voxel_size) if np.any(voxel_size != np.array(zooms)) else None
+    return FixPlan(affine_scale, new_zooms, new_units, tuple(fixes_applied), tuple(messages))
+
+def _header_is_clean(header):
+    """Check if a header already has the uint32 type, mm units and no temporal voxel size, so it needs no fixes."""
+    zooms = header.get_zooms()
+    return (header.get_data_dtype() == np.uint32 and header.get_xyzt_units()[0] == 'mm'
+            and (len(zooms) < 4 or zooms[3] == 0))
+
+def _is_unscaled(img):
+    """Check if a loaded image stores its voxel values without scl_slope/scl_inter scaling."""
+    # nibabel moves the header scaling into the array proxy when it loads an image
+    return img.dataobj.slope == 1 and img.dataobj.inter == 0
+
+def fix_header_and_affine_issues(header, affine):
+    """
+    Fix common header and affine issues from ImageJ exports.
+    
+    Args:
+        header: nibabel header object
+        affine: nibabel affine matrix
+        
+    Returns:
+        tuple: (fixed_header, fixed_affine, list_of_fixes_applied)
+    """
+    if _header_is_clean(header):
+        return header, affine, []
     
-    return header, affine, fixes_applied
+    # Fix data type to uint32
+    header.set_data_dtype(np.uint32)
+    
+    plan = _decide_fixes(tuple(header.get_zooms()), header.get_xyzt_units())
+    
+    if plan.new_zooms is not None:
+        header.set_zooms(plan.new_zooms)
+    if plan.new_units is not None:
+        header.set_xyzt_units(*plan.new_units)
+    if plan.affine_scale != 1.0:
+        # Scale a copy of the affine so the original is not modified
+        affine = affine.copy()
+        affine[:3, :] *= plan.affine_scale
+    
+    for message in plan.messages:
+        logger.info(message)
+    
+    return header, affine, list(plan.fixes_applied)
 
-def convert_nii_file(input_path, output_path=None, check_existing=True, offset=32768.0):
+def convert_nii_file(input_path, output_path=None, check_existing=True, offset=32768.0, compress_level=1,
+                     input_size=None, check_input=True):
     """
     Convert a single .nii file to .nii.gz with fixes.
     
@@ -94,13 +204,17 @@ def convert_nii_file(input_path, output_path=None, check_existing=True, offset=3
         output_path: path for output .nii.gz file (optional)
         check_existing: skip if output already exists
         offset: offset for signed array correction
+        compress_level: gzip compression level (1-9)
+        input_size: size of the input file in bytes if already known (optional)
+        check_input: check that the input file exists
         
     Returns:
-        dict with conversion results
+        dict with conversion results. For unsigned integer data, which can't be negative, the min values
+        are the lower bound 0 of the data type and the voxels are not scanned for them
     """
     input_path = Path(input_path)
     
-    if not input_path.exists():
+    if check_input and not input_path.exists():
         return {'success': False, 'error': 'Input file does not exist'}
     
     if not input_path.name.endswith('.nii'):
@@ -123,29 +237,55 @@ def convert_nii_file(input_path, output_path=None, check_existing=True, offset=3
         # Load the image
         logger.debug(f"Loading {input_path.name}")
         img = nib.load(input_path)
-        data = img.get_fdata()
-        affine = img.affine.copy()
-        header = img.header.copy()
-        
-        # Fix signed array issues
-        original_min = np.min(data)
-        data = fix_signed_array(data, offset)
         
-        # Fix header AND affine issues (this is the key fix)
-        header, affine, fixes_applied = fix_header_and_affine_issues(header, affine)
-        
-        # Create output directory if needed
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Save as compressed NIfTI with fixed affine
-        new_img = nib.Nifti1Image(data, affine, header)
-        nib.save(new_img, output_path)
+        if output_path.name.endswith('.gz') and _header_is_clean(img.header) and _is_unscaled(img):
+            # Files that need no fixes are compressed byte for byte, without decoding and re-encoding the voxels.
+            # Unscaled uint32 data can't be negative and needs no offset, so like fix_signed_array the minimum
+            # is taken from the data type instead of reading the volume
+            original_min = final_min = 0.0
+            fixes_applied = []
+            fast_path = True
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(input_path, 'rb') as src_file, open_gzip_output(output_path, compress_level) as gz_file:
+                shutil.copyfileobj(src_file, gz_file, length=4 * 1024 * 1024)
+        else:
+            fast_path = False
+            # Keep the stored data type instead of upcasting the whole volume to float64
+            data = np.asanyarray(img.dataobj)
+            affine = img.affine.copy()
+            header = img.header.copy()
+            
+            # Fix signed array issues, the minimum after the fix follows from the original one.
+            # It is computed in double precision like the offset data, not in the stored type (e.g. float32)
+            stored_integers = np.issubdtype(data.dtype, np.integer) and data.dtype.itemsize <= 4
+            data, original_min = fix_signed_array(data, offset)
+            original_min = float(original_min)
+            final_min = original_min + offset if original_min < 0 else original_min
+            
+            # Fix header AND affine issues (this is the key fix)
+            header, affine, fixes_applied = fix_header_and_affine_issues(header, affine)
+            
+            # Non-negative integer data fits the uint32 output type exactly, so it is written without scaling
+            if stored_integers and final_min >= 0:
+                data = data.astype(np.uint32, copy=False)
+            
+            # Create output directory if needed
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Save as compressed NIfTI with fixed affine
+            new_img = nib.Nifti1Image(data, affine, header)
+            if output_path.name.endswith('.gz'):
+                with open_gzip_output(output_path, compress_level) as gz_file:
+                    new_img.to_stream(gz_file)
+            else:
+                nib.save(new_img, output_path)
         
         # Calculate file size reduction
-        size_reduction = input_path.stat().st_size / output_path.stat().st_size
+        if input_size is None:
+            input_size = input_path.stat().st_size
+        size_reduction = input_size / output_path.stat().st_size
         
         # Check final result
-        final_min = np.min(data)
         if final_min < 0:
             logger.warning(f"Warning: {output_path.name} still has negative values (min: {final_min:.1f})")
         
@@ -156,6 +296,7 @@ def convert_nii_file(input_path, output_path=None, check_existing=True, offset=3
             'original_min_value': float(original_min),
             'final_min_value': float(final_min),
             'fixes_applied': fixes_applied,
+            'fast_path': fast_path,
             'file_size_reduction': f"{size_reduction:.1f}x"
         }
         
@@ -167,8 +308,29 @@ def convert_nii_file(input_path, output_path=None, check_existing=True, offset=3
         logger.error(error_msg)
         return {'success': False, 'error': error_msg, 'input_path': str(input_path)}
 
+def _scan_nii_files(directory, recursive=True, relative_dir=''):
+    """
+    Yield (path, relative_path, size) of the .nii files in a directory.
+    
+    Paths are plain strings built during the walk and sizes come from the stat of the directory scan.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from _scan_nii_files(entry.path, recursive, relative_dir + entry.name + os.sep)
+            elif entry.name.endswith('.nii') and entry.is_file():
+                yield entry.path, relative_dir + entry.name, entry.stat().st_size
+
+def _convert_one(task):
+    """Convert a single (input_file, output_file, input_size, check_existing, offset, compress_level) task."""
+    nii_file, output_file, input_size, check_existing, offset, compress_level = task
+    # The directory scan has just found the input file, so it is not checked again
+    return convert_nii_file(nii_file, output_file, check_existing=check_existing, offset=offset,
+                            compress_level=compress_level, input_size=input_size, check_input=False)
+
 def convert_directory(input_dir, output_dir=None, recursive=True, offset=32768.0, 
-                     overwrite=False, show_progress=True):
+                     overwrite=False, show_progress=True, workers=1, compress_level=1, log_interval=None):
     """
     Convert all .nii files in a directory to .nii.gz.
     
@@ -178,7 +340,10 @@ def convert_directory(input_dir, output_dir=None, recursive=True, offset=32768.0
         recursive: search subdirectories
         offset: offset for signed array correction
         overwrite: overwrite existing files
-        show_progress: show progress bar
+        show_progress: show progress bar (only on an interactive terminal)
+        workers: number of files converted in parallel processes
+        compress_level: gzip compression level (1-9)
+        log_interval: log the progress every log_interval files when no progress bar is shown (optional)
         
     Returns:
         dict with conversion summary
@@ -194,11 +359,8 @@ def convert_directory(input_dir, output_dir=None, recursive=True, offset=32768.0
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Find all .nii files
-    if recursive:
-        nii_files = list(input_dir.rglob("*.nii"))
-    else:
-        nii_files = list(input_dir.glob("*.nii"))
+    # Find all .nii files together with their sizes
+    nii_files = sorted(_scan_nii_files(str(input_dir), recursive))
     
     if not nii_files:
         logger.warning(f"No .nii files found in {input_dir}")
@@ -206,41 +368,69 @@ def convert_directory(input_dir, output_dir=None, recursive=True, offset=32768.0
     
     logger.info(f"Found {len(nii_files)} .nii files to convert")
     
-    results = []
+    # One result per file in the order of nii_files
+    results = [None] * len(nii_files)
     successful = 0
     failed = 0
     skipped = 0
     
-    # Convert files with optional progress bar
-    iterator = tqdm(nii_files, desc="Converting files") if show_progress else nii_files
+    # Mirror the relative paths in the output directory, replacing the .nii extension with .nii.gz
+    output_prefix = os.path.join(str(output_dir), '')
+    tasks = [
+        (nii_file, output_prefix + rel_path[:-len('.nii')] + '.nii.gz', input_size,
+         not overwrite, offset, compress_level)
+        for nii_file, rel_path, input_size in nii_files
+    ]
     
-    for nii_file in iterator:
-        # Calculate relative path for output structure
-        rel_path = nii_file.relative_to(input_dir)
-        output_file = output_dir / rel_path.with_suffix('.nii.gz')
+    # Outputs that already exist are skipped up front, without a conversion call per file.
+    # convert_nii_file still checks for the output in case it appears in the meantime
+    pending = list(range(len(tasks)))
+    if not overwrite:
+        # Paths relative to the output directory are compared, so '.' or an unnormalized output_dir still match
+        existing = {path.relative_to(output_dir) for path in output_dir.rglob("*.nii.gz")}
+        pending = []
+        for index, (task, (_, rel_path, _)) in enumerate(zip(tasks, nii_files)):
+            if Path(rel_path[:-len('.nii')] + '.nii.gz') in existing:
+                results[index] = {'success': True, 'skipped': True, 'output_path': task[1]}
+            else:
+                pending.append(index)
+        skipped = len(tasks) - len(pending)
+        if skipped:
+            logger.info(f"Skipping {skipped} files with existing outputs")
+            tasks = [tasks[index] for index in pending]
+    
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+        # Files are independent, so they are converted in parallel processes when more than one worker is requested
+        converted = executor.map(_convert_one, tasks) if executor is not None else map(_convert_one, tasks)
         
-        result = convert_nii_file(
-            nii_file, 
-            output_file, 
-            check_existing=not overwrite,
-            offset=offset
-        )
-        results.append(result)
+        # Convert files with optional progress bar, piped and logged runs get no escape codes.
+        # The bar counts input bytes, so its rate and ETA hold up for files of very different sizes
+        show_bar = show_progress and sys.stderr.isatty()
+        progress_bar = tqdm(total=sum(task[2] for task in tasks), desc="Converting files", unit='B',
+                            unit_scale=True, mininterval=1.0, disable=not show_bar)
         
-        if result['success']:
-            if result.get('skipped', False):
-                skipped += 1
-            else:
-                successful += 1
-        else:
-            failed += 1
+        with progress_bar:
+            for i, (index, task, result) in enumerate(zip(pending, tasks, converted), 1):
+                results[index] = result
+                progress_bar.update(task[2])
+                
+                if log_interval and not show_bar and i % log_interval == 0:
+                    logger.info(f"Converted {i}/{len(tasks)} files")
+                
+                if result['success']:
+                    if result.get('skipped', False):
+                        skipped += 1
+                    else:
+                        successful += 1
+                else:
+                    failed += 1
     
     summary = {
         'total_files': len(nii_files),
         'successful': successful,
         'failed': failed,
         'skipped': skipped,
-        'success_rate': (successful / len(nii_files)) * 100 if nii_files else 0,
+        'success_rate': (successful / len(nii_files)) * 100,
         'results': results
     }
     
@@ -19,16 +19,6 @@ Quick usage:
     )
 """
 
-from .registration import (
-    affine_registration,
-    register_to_reference,
-    batch_register_folder,
-    register_modalities_to_reference,
-    register_file,
-    register_folder,
-    RegistrationConfig
-)
-
 __version__ = "1.0.0"
 __author__ = "Medical Imaging Tools"
 
@@ -42,3 +32,11 @@ __all__ = [
     'register_modalities_to_reference',
     'RegistrationConfig'
 ]
+
+
+def __getattr__(name):
+    # Resolve the registration API lazily, DIPY and matplotlib are only loaded once it is used
+    if name in __all__:
+        from . import registration
+        return getattr(registration, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
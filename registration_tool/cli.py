@@ -12,13 +12,6 @@ import sys
 import logging
 from pathlib import Path
 
-from .registration import (
-    affine_registration,
-    batch_register_folder,
-    register_modalities_to_reference,
-    RegistrationConfig
-)
-
 
 def setup_logging(verbose=False, quiet=False):
     """Setup logging configuration."""
@@ -35,6 +28,19 @@ def setup_logging(verbose=False, quiet=False):
     )
 
 
+def _sampling_prop(value):
+    """Argparse type for a sampling proportion in (0, 1], or 'none' for dense sampling."""
+    if value.lower() == 'none':
+        return None
+    try:
+        proportion = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid sampling proportion: {value}")
+    if not 0 < proportion <= 1:
+        raise argparse.ArgumentTypeError(f"sampling proportion must be in (0, 1]: {value}")
+    return proportion
+
+
 def create_parser():
     """Create command-line argument parser."""
     parser = argparse.ArgumentParser(
@@ -49,7 +55,10 @@ Examples:
   python -m registration_tool.cli --patient-folder patient_001/ --reference t1ce
   
   # Batch register folder
-  python -m registration_tool.cli --batch input_folder/ reference.nii.gz output_folder/
+  python -m registration_tool.cli --batch input_folder/ reference.nii.gz -o output_folder/
+  
+  # Batch register folder, 4 registrations at a time
+  python -m registration_tool.cli --jobs 4 --batch input_folder/ reference.nii.gz -o output_folder/
   
   # Register with visualization
   python -m registration_tool.cli moving.nii.gz reference.nii.gz -o output.nii.gz --show-plots
@@ -59,14 +68,14 @@ Examples:
         """
     )
     
-    # Input specification (mutually exclusive groups)
-    input_group = parser.add_mutually_exclusive_group(required=True)
-    
-    input_group.add_argument(
+    # Input specification (a moving file, or one of the folder modes)
+    parser.add_argument(
         'moving_file', nargs='?',
         help='Moving image file (for single file registration)'
     )
     
+    input_group = parser.add_mutually_exclusive_group()
+    
     input_group.add_argument(
         '--patient-folder',
         help='Patient folder containing multiple modalities'
@@ -115,12 +124,21 @@ Examples:
         help='Number of bins for mutual information (default: 32)'
     )
     
+    parser.add_argument(
+        '--sampling-prop',
+        type=_sampling_prop,
+        default=0.25,
+        help="Fraction of voxels sampled for mutual information, or 'none' to use "
+             "every voxel (default: 0.25). Sampled points get a fixed-seed jitter, so "
+             "results are repeatable but differ slightly from 'none'"
+    )
+    
     parser.add_argument(
         '--level-iters',
         nargs=3,
         type=int,
-        default=[10000, 1000, 100],
-        help='Iterations per level (default: 10000 1000 100)'
+        default=[1000, 500, 100],
+        help='Iterations per level (default: 1000 500 100)'
     )
     
     parser.add_argument(
@@ -139,6 +157,33 @@ Examples:
         help='Subsampling factors per level (default: 4 2 1)'
     )
     
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of registrations to run in parallel (batch and patient folder modes, default: 1)'
+    )
+    
+    parser.add_argument(
+        '--mask-background',
+        action='store_true',
+        help='Ignore low-intensity background voxels in mutual information '
+             '(requires --sampling-prop none)'
+    )
+    
+    parser.add_argument(
+        '--bilateral',
+        action='store_true',
+        help='Edge-preserving bilateral filtering before optimization (requires SimpleITK)'
+    )
+    
+    parser.add_argument(
+        '--quantize',
+        action='store_true',
+        help='Window intensities to the 1st-99th percentile and quantize to 8 bits '
+             'before optimization'
+    )
+    
     # Visualization and output options
     parser.add_argument(
         '--show-plots',
@@ -152,6 +197,15 @@ Examples:
         help='Save registration plots to file'
     )
     
+    parser.add_argument(
+        '--compress-level',
+        type=int,
+        default=1,
+        choices=range(1, 10),
+        metavar='{1-9}',
+        help='Gzip compression level for .nii.gz outputs (default: 1)'
+    )
+    
     # Logging options
     parser.add_argument(
         '-v', '--verbose',
@@ -174,28 +228,57 @@ Examples:
     return parser
 
 
-def validate_args(args):
-    """Validate command-line arguments."""
+def _resolve_positionals(args):
+    """In batch mode the only positional argument is the reference file."""
+    if args.batch and args.moving_file and not args.reference_file:
+        args.reference_file, args.moving_file = args.moving_file, None
+
+
+def _validate_args_cheap(args):
+    """Check argument values and combinations, without touching the filesystem."""
     errors = []
     
+    if args.jobs < 1:
+        errors.append("Number of jobs must be at least 1")
+    
+    if not (args.moving_file or args.patient_folder or args.batch):
+        errors.append("A moving file, --patient-folder or --batch is required")
+    elif args.moving_file and (args.patient_folder or args.batch):
+        errors.append("A moving file can't be combined with --patient-folder or --batch")
+    
     # Single file mode validation
-    if args.moving_file:
+    elif args.moving_file:
         if not args.reference_file:
             errors.append("Reference file required for single file registration")
-        
-        moving_path = Path(args.moving_file)
-        if not moving_path.exists():
-            errors.append(f"Moving file does not exist: {args.moving_file}")
-            
-        ref_path = Path(args.reference_file)
-        if not ref_path.exists():
-            errors.append(f"Reference file does not exist: {args.reference_file}")
     
     # Patient folder mode validation
     elif args.patient_folder:
         if not args.reference:
             errors.append("--reference modality required for patient folder mode")
-            
+    
+    # Batch mode validation
+    elif args.batch:
+        if not args.reference_file:
+            errors.append("Reference file required for batch mode")
+        if not args.output:
+            errors.append("Output folder required for batch mode")
+    
+    return errors
+
+
+def _validate_args_fs(args):
+    """Check that the input files and folders exist."""
+    errors = []
+    
+    # Single file mode validation
+    if args.moving_file:
+        if not Path(args.moving_file).exists():
+            errors.append(f"Moving file does not exist: {args.moving_file}")
+        if not Path(args.reference_file).exists():
+            errors.append(f"Reference file does not exist: {args.reference_file}")
+    
+    # Patient folder mode validation
+    elif args.patient_folder:
         patient_path = Path(args.patient_folder)
         if not patient_path.exists():
             errors.append(f"Patient folder does not exist: {args.patient_folder}")
@@ -204,18 +287,19 @@ def validate_args(args):
     
     # Batch mode validation
     elif args.batch:
-        if not args.reference_file:
-            errors.append("Reference file required for batch mode")
-        if not args.output:
-            errors.append("Output folder required for batch mode")
-            
-        batch_path = Path(args.batch)
-        if not batch_path.exists():
+        if not Path(args.batch).exists():
             errors.append(f"Batch folder does not exist: {args.batch}")
     
     return errors
 
 
+def _report_errors(errors):
+    """Print validation errors; returns True if there were any."""
+    for error in errors:
+        print(f"Error: {error}")
+    return bool(errors)
+
+
 def main():
     """Main CLI entry point."""
     parser = create_parser()
@@ -225,21 +309,36 @@ def main():
     setup_logging(args.verbose, args.quiet)
     logger = logging.getLogger(__name__)
     
-    # Validate arguments
-    validation_errors = validate_args(args)
-    if validation_errors:
-        for error in validation_errors:
-            print(f"Error: {error}")
+    # Validate argument combinations first; they need neither DIPY nor the disk
+    _resolve_positionals(args)
+    if _report_errors(_validate_args_cheap(args)):
+        return 1
+    
+    # The registration module is only imported once the arguments are valid, so --help and
+    # argument errors don't wait for DIPY and matplotlib to load
+    from .registration import (
+        affine_registration,
+        batch_register_folder,
+        register_modalities_to_reference,
+        RegistrationConfig
+    )
+    
+    if _report_errors(_validate_args_fs(args)):
         return 1
     
     # Create registration configuration
     config = RegistrationConfig()
     config.nbins = args.nbins
+    config.sampling_prop = args.sampling_prop
     config.level_iters = args.level_iters
     config.sigmas = args.sigmas
     config.factors = args.factors
+    config.mask_background = args.mask_background
+    config.bilateral_preproc = args.bilateral
+    config.quantize_to_uint8 = args.quantize
     config.show_plots = args.show_plots
     config.save_plots = args.save_plots
+    config.compress_level = args.compress_level
     
     try:
         # Single file registration
@@ -279,7 +378,9 @@ def main():
                 patient_folder=args.patient_folder,
                 reference_modality=args.reference,
                 modalities=args.modalities,
-                output_folder=args.output
+                output_folder=args.output,
+                config=config,
+                jobs=args.jobs
             )
             
             if result.get('success', True):  # No explicit success field for this function
@@ -291,9 +392,8 @@ def main():
                 
                 # Show failed registrations
                 if result['failed'] > 0:
-                    failed_results = [r for r in result['results'] if not r['success']]
                     print(f"  Failed registrations:")
-                    for failed in failed_results:
+                    for failed in result['failed_results']:
                         print(f"    - {failed.get('modality', 'unknown')}: {failed['error']}")
             else:
                 print(f"✗ Patient processing failed: {result['error']}")
@@ -307,7 +407,9 @@ def main():
                 input_folder=args.batch,
                 reference_file=args.reference_file,
                 output_folder=args.output,
-                pattern=args.pattern
+                pattern=args.pattern,
+                config=config,
+                jobs=args.jobs
             )
             
             print(f"✓ Batch registration completed!")
@@ -318,7 +420,7 @@ def main():
             
             # Show failed registrations
             if summary['failed'] > 0:
-                failed_results = [r for r in summary['results'] if not r['success']]
+                failed_results = summary['failed_results']
                 print(f"  Failed registrations:")
                 for failed in failed_results[:5]:  # Show first 5 failures
                     input_file = Path(failed['input_file']).name
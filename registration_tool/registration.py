@@ -7,14 +7,19 @@ suboptimal results. Performs multi-level registration with mutual information.
 """
 
 import os
+import re
+import gzip
+import fnmatch
 import numpy as np
-import matplotlib.pyplot as plt
+import nibabel as nib
+from nibabel.affines import voxel_sizes
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from time import time
 import logging
 
 # DIPY imports
-from dipy.io.image import load_nifti, save_nifti
 from dipy.align.imaffine import (
     transform_centers_of_mass,
     AffineMap,
@@ -27,15 +32,26 @@ from dipy.align.transforms import (
     AffineTransform3D
 )
 
-# Optional visualization (FURY not always available)
+# Optional edge-preserving preprocessing (SimpleITK not always available)
 try:
-    from dipy.viz import regtools
-    VIZ_AVAILABLE = True
+    import SimpleITK as sitk
+    SITK_AVAILABLE = True
 except ImportError:
-    VIZ_AVAILABLE = False
+    SITK_AVAILABLE = False
+
+# Optional native thread pool control for batch workers (threadpoolctl not always available)
+try:
+    from threadpoolctl import threadpool_limits
+    THREADPOOLCTL_AVAILABLE = True
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Modality name of an image file: the last "_"-separated part before the extension,
+# e.g. "t1ce" in "patient_001_t1ce.nii.gz"
+_MOD_RE = re.compile(r'([^_]+)\.nii(?:\.gz)?$')
+
 
 class RegistrationConfig:
     """Configuration class for registration parameters."""
@@ -43,23 +59,220 @@ class RegistrationConfig:
     def __init__(self):
         # Mutual Information parameters
         self.nbins = 32
-        self.sampling_prop = None
+        # Fraction of voxels sampled for the MI histogram (None = every voxel).
+        # ~1e5 samples are enough for a stable estimate; a quarter of a brain
+        # volume is still millions of voxels at a quarter of the cost per evaluation.
+        # DIPY jitters the sampled points with a fixed seed, so results repeat across
+        # runs but differ slightly from dense sampling
+        self.sampling_prop = 0.25
+        
+        # Working dtype of the loaded volumes
+        self.dtype = np.float32
         
-        # Multi-level optimization parameters
-        self.level_iters = [10000, 1000, 100]
+        # Multi-level optimization parameters (maximum function evaluations per
+        # level, coarse to fine); L-BFGS-B normally converges well within these
+        self.level_iters = [1000, 500, 100]
         self.sigmas = [3.0, 1.0, 0.0]
         self.factors = [4, 2, 1]
         
+        # L-BFGS-B convergence tolerances, each level stops as soon as either is met
+        self.gtol = 1e-4
+        self.ftol = 2.220446049250313e-09
+        
+        # Restrict the MI histogram to voxels above a low intensity percentile so air and
+        # background don't crowd the bins. DIPY only supports masks with dense sampling
+        # (sampling_prop = None)
+        self.mask_background = False
+        self.mask_percentile = 5
+        
+        # Bilateral filtering of both images before optimization (requires SimpleITK);
+        # removes fine texture but keeps edges, which smooths the MI landscape.
+        # The spatial sigma is in mm, the color sigma in intensity units (None = image std)
+        self.bilateral_preproc = False
+        self.bilateral_sigma_spatial = 2.0
+        self.bilateral_sigma_color = None
+        
+        # Window intensities to the 1st-99th percentile of the foreground and quantize
+        # them to uint8 before optimization, so a few very bright voxels can't squeeze
+        # the tissue into a handful of MI bins
+        self.quantize_to_uint8 = False
+        
         # Visualization
         self.show_plots = False
         self.save_plots = False
         
         # Output
         self.output_format = "nii.gz"
+        # Gzip level for .nii.gz outputs; 1 matches nibabel's own default, raise it
+        # for smaller files at the cost of write time
+        self.compress_level = 1
+
+
+def _noop(msg):
+    """Progress callback that discards its messages."""
+
+
+def _as_volume(data, dtype=np.float32):
+    """Reduce 4D data to its first volume as a contiguous array of the working dtype."""
+    if data.ndim == 4:
+        data = data[:,:,:,0]
+    data = np.asarray(data, dtype=dtype)
+    # NIfTI data is Fortran-ordered (and so is its first volume); keep that order
+    # rather than transposing it in memory, only copy views that aren't contiguous
+    if not (data.flags.c_contiguous or data.flags.f_contiguous):
+        data = np.ascontiguousarray(data)
+    return data
+
+
+def _load_volume(path, dtype=np.float32):
+    """Load a NIfTI image as (data, affine), keeping only the first volume of 4D data."""
+    img = nib.load(path)
+    if img.ndim == 4:
+        # Slicing the proxy only reads (and decompresses) the first volume,
+        # not the whole series
+        data = img.dataobj[..., 0]
+    else:
+        data = np.asanyarray(img.dataobj)
+    return _as_volume(data, dtype), img.affine
+
+
+def _preload_reference(reference_file, dtype=np.float32):
+    """Load a reference shared by several registrations, or None if it can't be read."""
+    try:
+        return _load_volume(reference_file, dtype)
+    except Exception as e:
+        # Leave it to each registration to report the failure
+        logger.warning(f"Could not preload reference {reference_file}: {e}")
+        return None
+
+
+def _bilateral_filter(data, grid2world, sigma_spatial, sigma_color=None):
+    """Edge-preserving smoothing of a 3D volume with SimpleITK's bilateral filter."""
+    if sigma_color is None:
+        sigma_color = float(data.std())
+    
+    # SimpleITK reverses the array axes, so the voxel sizes go in reversed order too
+    image = sitk.GetImageFromArray(data)
+    image.SetSpacing([float(v) for v in voxel_sizes(grid2world)[::-1]])
+    filtered = sitk.Bilateral(image, domainSigma=sigma_spatial, rangeSigma=sigma_color)
+    return sitk.GetArrayFromImage(filtered).astype(data.dtype, copy=False)
+
+
+def _save_volume(path, data, affine, compress_level=1):
+    """Save a volume as NIfTI, gzip-compressing .nii.gz outputs at compress_level."""
+    img = nib.Nifti1Image(data, affine)
+    if str(path).endswith('.gz'):
+        with open(path, 'wb') as f, \
+                gzip.GzipFile(fileobj=f, mode='wb', compresslevel=compress_level, mtime=0) as gz_file:
+            img.to_stream(gz_file)
+    else:
+        nib.save(img, path)
+
+
+def _quantize_uint8(data, low_percentile=1, high_percentile=99):
+    """Window a volume to percentiles of its nonzero voxels and quantize it to uint8."""
+    foreground = data[data > 0]
+    if foreground.size == 0:
+        foreground = data
+    lo, hi = (float(v) for v in np.percentile(foreground, [low_percentile, high_percentile]))
+    if hi <= lo:
+        return np.zeros(data.shape, dtype=np.uint8)
+    
+    scaled = data - lo
+    scaled *= 255.0 / (hi - lo)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def _foreground_mask(data, percentile):
+    """Mask of the voxels above the given intensity percentile."""
+    # int32 rather than bool: DIPY resamples the masks with its numeric interpolators
+    return (data > np.percentile(data, percentile)).astype(np.int32)
+
+
+def _is_same_image(static, static_grid2world, moving, moving_grid2world):
+    """Whether moving is exactly the static image (same grid, same voxels)."""
+    return (static.shape == moving.shape
+            and np.array_equal(static_grid2world, moving_grid2world)
+            and np.array_equal(static, moving))
+
+
+def _optimize_stages(static, static_grid2world, moving, moving_grid2world,
+                     config, progress_callback):
+    """Run the center of mass -> translation -> rigid -> affine stages."""
+    if _is_same_image(static, static_grid2world, moving, moving_grid2world):
+        # Each stage would only drift away from the identity it starts at
+        progress_callback("Moving and static images are identical, skipping optimization")
+        identity = AffineMap(np.eye(4),
+                             domain_grid_shape=static.shape,
+                             domain_grid2world=static_grid2world,
+                             codomain_grid_shape=moving.shape,
+                             codomain_grid2world=moving_grid2world)
+        return identity, identity, identity, identity
+    
+    # Center of mass transform
+    progress_callback("Computing center of mass alignment...")
+    c_of_mass = transform_centers_of_mass(static, static_grid2world, 
+                                        moving, moving_grid2world)
+    
+    # Set up Affine Registration
+    metric = MutualInformationMetric(config.nbins, config.sampling_prop)
+    affreg = AffineRegistration(
+        metric=metric,
+        level_iters=config.level_iters,
+        sigmas=config.sigmas,
+        factors=config.factors,
+        options={'gtol': config.gtol, 'ftol': config.ftol}
+    )
+    
+    masks = {}
+    if config.mask_background and config.sampling_prop is None:
+        masks = {
+            'static_mask': _foreground_mask(static, config.mask_percentile),
+            'moving_mask': _foreground_mask(moving, config.mask_percentile)
+        }
+    elif config.mask_background:
+        logger.warning("Background masking needs dense sampling (sampling_prop=None), not masking")
+    
+    # Translation transform
+    progress_callback("Computing translation transform...")
+    transform = TranslationTransform3D()
+    starting_affine = c_of_mass.affine
+    translation = affreg.optimize(
+        static, moving, transform, None,
+        static_grid2world, moving_grid2world,
+        starting_affine=starting_affine,
+        **masks
+    )
+    
+    # Rigid transform  
+    progress_callback("Computing rigid transform...")
+    transform = RigidTransform3D()
+    starting_affine = translation.affine
+    rigid = affreg.optimize(
+        static, moving, transform, None,
+        static_grid2world, moving_grid2world,
+        starting_affine=starting_affine,
+        **masks
+    )
+    
+    # Affine transform
+    progress_callback("Computing affine transform...")
+    transform = AffineTransform3D()
+    starting_affine = rigid.affine
+    affine = affreg.optimize(
+        static, moving, transform, None,
+        static_grid2world, moving_grid2world,
+        starting_affine=starting_affine,
+        **masks
+    )
+    
+    return c_of_mass, translation, rigid, affine
 
 
 def affine_registration(moving_file, static_file, output_file=None, 
-                       config=None, show_plots=False, progress_callback=None):
+                       config=None, show_plots=False, progress_callback=None,
+                       static_preloaded=None, moving_preloaded=None):
     """
     Perform affine registration between two images.
     
@@ -70,6 +283,8 @@ def affine_registration(moving_file, static_file, output_file=None,
         config: RegistrationConfig object (optional)
         show_plots: Show visualization plots
         progress_callback: Function to call with progress updates
+        static_preloaded: (data, affine) of the static image, skips loading static_file
+        moving_preloaded: (data, affine) of the moving image, skips loading moving_file
         
     Returns:
         dict with registration results
@@ -80,70 +295,46 @@ def affine_registration(moving_file, static_file, output_file=None,
         config = RegistrationConfig()
     
     if progress_callback is None:
-        progress_callback = lambda msg: logger.info(msg)
+        progress_callback = logger.info if logger.isEnabledFor(logging.INFO) else _noop
     
     try:
         # Load the data
         progress_callback("Loading images...")
-        static_data, static_affine, static_img = load_nifti(static_file, return_img=True)
-        moving_data, moving_affine, moving_img = load_nifti(moving_file, return_img=True)
+        if static_preloaded is None:
+            static_preloaded = _load_volume(static_file, config.dtype)
+        if moving_preloaded is None:
+            moving_preloaded = _load_volume(moving_file, config.dtype)
         
-        # Handle 4D data by taking first volume
-        if static_data.ndim == 4:
-            static = static_data[:,:,:,0]
-        else:
-            static = static_data
-            
-        if moving_data.ndim == 4:
-            moving = moving_data[:,:,:,0]
-        else:
-            moving = moving_data
+        # One contiguous array per image in the working dtype; a no-op for
+        # volumes that came through _load_volume
+        static, static_affine = static_preloaded
+        moving, moving_affine = moving_preloaded
+        static = _as_volume(static, config.dtype)
+        moving = _as_volume(moving, config.dtype)
         
         static_grid2world = static_affine
         moving_grid2world = moving_affine
         
-        # Center of mass transform
-        progress_callback("Computing center of mass alignment...")
-        c_of_mass = transform_centers_of_mass(static, static_grid2world, 
-                                            moving, moving_grid2world)
-        
-        # Set up Affine Registration
-        metric = MutualInformationMetric(config.nbins, config.sampling_prop)
-        affreg = AffineRegistration(
-            metric=metric,
-            level_iters=config.level_iters,
-            sigmas=config.sigmas,
-            factors=config.factors
-        )
+        # Images the optimizer sees; the transform is still applied to the original moving image
+        static_opt, moving_opt = static, moving
+        if config.bilateral_preproc and SITK_AVAILABLE:
+            progress_callback("Bilateral filtering images...")
+            static_opt = _bilateral_filter(static, static_grid2world,
+                                           config.bilateral_sigma_spatial,
+                                           config.bilateral_sigma_color)
+            moving_opt = _bilateral_filter(moving, moving_grid2world,
+                                           config.bilateral_sigma_spatial,
+                                           config.bilateral_sigma_color)
+        elif config.bilateral_preproc:
+            logger.warning("Bilateral preprocessing not available (SimpleITK not installed)")
         
-        # Translation transform
-        progress_callback("Computing translation transform...")
-        transform = TranslationTransform3D()
-        starting_affine = c_of_mass.affine
-        translation = affreg.optimize(
-            static, moving, transform, None,
-            static_grid2world, moving_grid2world,
-            starting_affine=starting_affine
-        )
+        if config.quantize_to_uint8:
+            static_opt = _quantize_uint8(static_opt)
+            moving_opt = _quantize_uint8(moving_opt)
         
-        # Rigid transform  
-        progress_callback("Computing rigid transform...")
-        transform = RigidTransform3D()
-        starting_affine = translation.affine
-        rigid = affreg.optimize(
-            static, moving, transform, None,
-            static_grid2world, moving_grid2world,
-            starting_affine=starting_affine
-        )
-        
-        # Affine transform
-        progress_callback("Computing affine transform...")
-        transform = AffineTransform3D()
-        starting_affine = rigid.affine
-        affine = affreg.optimize(
-            static, moving, transform, None,
-            static_grid2world, moving_grid2world,
-            starting_affine=starting_affine
+        c_of_mass, translation, rigid, affine = _optimize_stages(
+            static_opt, static_grid2world, moving_opt, moving_grid2world,
+            config, progress_callback
         )
         
         # Apply the transformation
@@ -154,14 +345,14 @@ def affine_registration(moving_file, static_file, output_file=None,
         if output_file:
             output_path = Path(output_file)
             output_path.parent.mkdir(parents=True, exist_ok=True)
-            save_nifti(str(output_path), transformed, static_affine)
+            # Written in the working dtype; DIPY resamples in float64
+            _save_volume(output_path, transformed.astype(config.dtype, copy=False),
+                         static_affine, config.compress_level)
             progress_callback(f"Saved registered image to {output_path}")
         
         # Show plots if requested
-        if show_plots and VIZ_AVAILABLE:
+        if show_plots:
             _show_registration_plots(static, transformed)
-        elif show_plots and not VIZ_AVAILABLE:
-            logger.warning("Visualization not available (FURY not installed)")
         
         elapsed_time = time() - start_time
         progress_callback(f"Registration completed in {elapsed_time:.1f} seconds")
@@ -193,7 +384,12 @@ def affine_registration(moving_file, static_file, output_file=None,
 
 def _show_registration_plots(static, transformed):
     """Show overlay plots of registration results."""
-    if not VIZ_AVAILABLE:
+    # The plotting modules are only imported when plots are actually requested
+    try:
+        import matplotlib.pyplot as plt
+        from dipy.viz import regtools
+    except ImportError:
+        logger.warning("Visualization not available (FURY not installed)")
         return
         
     try:
@@ -222,8 +418,104 @@ def register_to_reference(moving_file, reference_file, output_file=None, **kwarg
     return affine_registration(moving_file, reference_file, output_file, **kwargs)
 
 
+def _limit_worker_threads():
+    """Pin the BLAS and OpenMP thread pools to one thread inside a registration worker."""
+    # The pool already runs one registration per core; letting BLAS/OpenMP spawn
+    # their own threads on top of that oversubscribes the machine. Workers inherit
+    # the pools numpy and DIPY started at import, which the *_NUM_THREADS variables
+    # can no longer resize, so they are only limited when threadpoolctl is installed
+    if THREADPOOLCTL_AVAILABLE:
+        threadpool_limits(1)
+
+
+def _register_one(moving_file, reference_file, output_file, config, reference_data,
+                  moving_data=None):
+    """Register a single moving file to its reference; runs in worker processes."""
+    result = affine_registration(
+        moving_file=moving_file,
+        static_file=reference_file,
+        output_file=output_file,
+        config=config,
+        progress_callback=logger.debug if logger.isEnabledFor(logging.DEBUG) else _noop,
+        static_preloaded=reference_data,
+        moving_preloaded=moving_data
+    )
+    
+    # The registered volume has been written to disk; don't ship it back to the parent
+    result.pop('transformed_data', None)
+    result['input_file'] = str(moving_file)
+    result['reference_file'] = str(reference_file)
+    return result
+
+
+def _prefetch_volumes(files, dtype):
+    """Yield the loaded volume of each file, reading the next one in a background thread."""
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        upcoming = loader.submit(_load_volume, files[0], dtype) if files else None
+        for i in range(len(files)):
+            current = upcoming
+            if i + 1 < len(files):
+                upcoming = loader.submit(_load_volume, files[i + 1], dtype)
+            try:
+                yield current.result()
+            except Exception:
+                # Let the registration load the file itself and report the error
+                yield None
+
+
+def _run_registrations(moving_files, reference_files, output_files, config,
+                       reference_data=None, jobs=1):
+    """
+    Yield registration results in input order, using a process pool if jobs > 1.
+    
+    The file lists are parallel: the i-th moving file is registered to the i-th
+    reference and written to the i-th output. config and reference_data are shared.
+    """
+    n_files = len(moving_files)
+    shared = (repeat(config, n_files), repeat(reference_data, n_files))
+    
+    if jobs > 1 and n_files > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, n_files),
+                                 initializer=_limit_worker_threads) as executor:
+            yield from executor.map(_register_one, moving_files, reference_files,
+                                    output_files, *shared)
+    else:
+        # Decompressing the next moving image overlaps with the current registration
+        moving_data = _prefetch_volumes(moving_files, config.dtype)
+        yield from map(_register_one, moving_files, reference_files, output_files,
+                       *shared, moving_data)
+
+
+def _name_regex(pattern):
+    """Compile a shell-style file name pattern (e.g. "*t1ce*.nii.gz") once."""
+    return re.compile(fnmatch.translate(pattern))
+
+
+def _modality_name(file_name):
+    """Modality part of an image file name, or 'unknown' if it isn't a NIfTI name."""
+    match = _MOD_RE.search(file_name)
+    return match.group(1) if match else 'unknown'
+
+
+def _scan_folder(root, name_re, recursive=False, relative_dir=''):
+    """
+    Yield (path, relative_path) of the files in root whose name matches name_re.
+    
+    Paths are plain strings built during a single os.scandir walk.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from _scan_folder(entry.path, name_re, recursive,
+                                            relative_dir + entry.name + os.sep)
+            elif name_re.match(entry.name) and entry.is_file():
+                yield entry.path, relative_dir + entry.name
+
+
 def batch_register_folder(input_folder, reference_file, output_folder, 
-                         pattern="*.nii.gz", reference_pattern=None):
+                         pattern="*.nii.gz", reference_pattern=None,
+                         config=None, jobs=1):
     """
     Register all images in a folder to a reference image.
     
@@ -233,6 +525,8 @@ def batch_register_folder(input_folder, reference_file, output_folder,
         output_folder: Output folder for registered images
         pattern: File pattern to match (default: "*.nii.gz")
         reference_pattern: If provided, find reference in each subfolder
+        config: RegistrationConfig object (optional)
+        jobs: Number of registrations to run in parallel processes
         
     Returns:
         Dictionary with batch registration results
@@ -241,81 +535,78 @@ def batch_register_folder(input_folder, reference_file, output_folder,
     output_path = Path(output_folder)
     output_path.mkdir(parents=True, exist_ok=True)
     
-    # Find files to process
+    # Find files to process, as parallel lists of moving, reference and output paths
+    name_re = _name_regex(pattern)
+    moving_files = []
+    reference_files = []
+    output_files = []
+    
     if reference_pattern:
         # Process patient folders with reference in each
-        patient_folders = [d for d in input_path.iterdir() if d.is_dir()]
-        files_to_process = []
+        ref_re = _name_regex(reference_pattern)
+        with os.scandir(input_path) as entries:
+            patient_folders = sorted(e.path for e in entries if e.is_dir())
         
         for patient_folder in patient_folders:
             # Find reference file in this folder
-            ref_files = list(patient_folder.glob(reference_pattern))
+            ref_files = sorted(path for path, _ in _scan_folder(patient_folder, ref_re))
             if not ref_files:
                 logger.warning(f"No reference file found in {patient_folder}")
                 continue
             local_ref = ref_files[0]
+            patient_output = output_path / os.path.basename(patient_folder)
             
             # Find other files to register
-            other_files = [f for f in patient_folder.glob(pattern) 
-                          if f != local_ref]
-            
-            for file_to_register in other_files:
-                files_to_process.append({
-                    'moving': file_to_register,
-                    'reference': local_ref,
-                    'output_folder': output_path / patient_folder.name
-                })
+            for file_to_register, name in sorted(_scan_folder(patient_folder, name_re)):
+                if file_to_register != local_ref:
+                    moving_files.append(file_to_register)
+                    reference_files.append(local_ref)
+                    output_files.append(patient_output / name)
     else:
         # Register all files to single reference
-        files_to_process = []
-        for file_path in input_path.rglob(pattern):
-            if file_path.name != Path(reference_file).name:
-                rel_path = file_path.relative_to(input_path)
-                output_file = output_path / rel_path
-                files_to_process.append({
-                    'moving': file_path,
-                    'reference': reference_file,
-                    'output_file': output_file
-                })
-    
-    logger.info(f"Found {len(files_to_process)} files to register")
+        reference_name = os.path.basename(reference_file)
+        for file_path, rel_path in sorted(_scan_folder(input_path, name_re, recursive=True)):
+            if os.path.basename(file_path) != reference_name:
+                moving_files.append(file_path)
+                output_files.append(output_path / rel_path)
+        reference_files = [reference_file] * len(moving_files)
+    
+    n_files = len(moving_files)
+    logger.info(f"Found {n_files} files to register")
+    
+    # With a single reference, read and decompress it once for the whole batch
+    # instead of once per registration
+    if config is None:
+        config = RegistrationConfig()
+    
+    shared_reference = None
+    if moving_files and not reference_pattern:
+        shared_reference = _preload_reference(reference_file, config.dtype)
     
     results = []
-    successful = 0
-    failed = 0
+    failed_results = []
     
-    for i, item in enumerate(files_to_process):
-        logger.info(f"Processing {i+1}/{len(files_to_process)}: {item['moving'].name}")
-        
-        # Determine output file path
-        if 'output_file' in item:
-            output_file = item['output_file']
-        else:
-            output_file = item['output_folder'] / item['moving'].name
-        
-        result = affine_registration(
-            moving_file=item['moving'],
-            static_file=item['reference'],
-            output_file=output_file,
-            progress_callback=lambda msg: logger.debug(msg)
-        )
-        
-        result['input_file'] = str(item['moving'])
-        result['reference_file'] = str(item['reference'])
+    registrations = _run_registrations(moving_files, reference_files, output_files,
+                                       config, shared_reference, jobs)
+    log_progress = logger.isEnabledFor(logging.INFO)
+    for i, result in enumerate(registrations):
+        if log_progress:
+            logger.info(f"Processed {i+1}/{n_files}: {Path(result['input_file']).name}")
         results.append(result)
         
-        if result['success']:
-            successful += 1
-        else:
-            failed += 1
-            logger.error(f"Failed to register {item['moving'].name}: {result['error']}")
+        if not result['success']:
+            failed_results.append(result)
+            logger.error(f"Failed to register {Path(result['input_file']).name}: {result['error']}")
     
+    failed = len(failed_results)
+    successful = len(results) - failed
     summary = {
-        'total_files': len(files_to_process),
+        'total_files': n_files,
         'successful': successful,
         'failed': failed,
-        'success_rate': (successful / len(files_to_process)) * 100 if files_to_process else 0,
-        'results': results
+        'success_rate': (successful / n_files) * 100 if n_files else 0,
+        'results': results,
+        'failed_results': failed_results
     }
     
     logger.info(f"Batch registration complete: {successful} successful, {failed} failed")
@@ -323,7 +614,8 @@ def batch_register_folder(input_folder, reference_file, output_folder,
 
 
 def register_modalities_to_reference(patient_folder, reference_modality="t1ce", 
-                                    modalities=None, output_folder=None):
+                                    modalities=None, output_folder=None,
+                                    config=None, jobs=1):
     """
     Register multiple modalities to a reference modality for a single patient.
     
@@ -332,6 +624,8 @@ def register_modalities_to_reference(patient_folder, reference_modality="t1ce",
         reference_modality: Modality to use as reference (e.g., "t1ce")
         modalities: List of modalities to register (if None, registers all)
         output_folder: Output folder (defaults to input folder)
+        config: RegistrationConfig object (optional)
+        jobs: Number of modalities to register in parallel processes
         
     Returns:
         Registration results
@@ -344,9 +638,14 @@ def register_modalities_to_reference(patient_folder, reference_modality="t1ce",
     else:
         output_folder = Path(output_folder) / patient_name
     
+    # Scan the patient folder once; the reference and modalities are picked from
+    # the same listing instead of globbing the folder again for each of them
+    patient_files = sorted(_scan_folder(patient_path, _name_regex("*.nii.gz")))
+    
     # Find reference file
     ref_pattern = f"*{reference_modality}*.nii.gz"
-    ref_files = list(patient_path.glob(ref_pattern))
+    ref_re = _name_regex(ref_pattern)
+    ref_files = [path for path, name in patient_files if ref_re.match(name)]
     
     if not ref_files:
         return {
@@ -355,41 +654,48 @@ def register_modalities_to_reference(patient_folder, reference_modality="t1ce",
         }
     
     reference_file = ref_files[0]
-    logger.info(f"Using reference: {reference_file.name}")
+    reference_name = os.path.basename(reference_file)
+    logger.info(f"Using reference: {reference_name}")
     
     # Find modalities to register
     if modalities is None:
-        # Find all .nii.gz files except reference
-        all_files = list(patient_path.glob("*.nii.gz"))
-        files_to_register = [f for f in all_files if f != reference_file]
+        # All .nii.gz files except reference
+        files_to_register = [path for path, _ in patient_files if path != reference_file]
     else:
         files_to_register = []
         for modality in modalities:
-            pattern = f"*{modality}*.nii.gz"
-            mod_files = [f for f in patient_path.glob(pattern) if f != reference_file]
-            files_to_register.extend(mod_files)
+            mod_re = _name_regex(f"*{modality}*.nii.gz")
+            files_to_register.extend(path for path, name in patient_files
+                                     if mod_re.match(name) and path != reference_file)
     
-    logger.info(f"Registering {len(files_to_register)} files to {reference_file.name}")
+    logger.info(f"Registering {len(files_to_register)} files to {reference_name}")
+    
+    if config is None:
+        config = RegistrationConfig()
+    
+    # One reference serves every modality, so load it once
+    reference_data = _preload_reference(reference_file, config.dtype) if files_to_register else None
+    names = [os.path.basename(f) for f in files_to_register]
+    output_files = [output_folder / name for name in names]
+    modality_names = [_modality_name(name) for name in names]
+    registrations = _run_registrations(files_to_register, [reference_file] * len(files_to_register),
+                                       output_files, config, reference_data, jobs)
     
     results = []
-    for file_to_register in files_to_register:
-        output_file = output_folder / file_to_register.name
-        
-        result = affine_registration(
-            moving_file=file_to_register,
-            static_file=reference_file,
-            output_file=output_file
-        )
-        
-        result['modality'] = file_to_register.stem.split('_')[-1]  # Extract modality name
+    failed_results = []
+    for modality, result in zip(modality_names, registrations):
+        result['modality'] = modality
         results.append(result)
+        if not result['success']:
+            failed_results.append(result)
     
     return {
         'patient': patient_name,
-        'reference_file': str(reference_file),
+        'reference_file': reference_file,
         'results': results,
-        'successful': sum(1 for r in results if r['success']),
-        'failed': sum(1 for r in results if not r['success'])
+        'failed_results': failed_results,
+        'successful': len(results) - len(failed_results),
+        'failed': len(failed_results)
     }
 
 
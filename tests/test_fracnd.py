@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from fracnd import FracND, greyscale_to_binary, greyscale_to_levels
+
+
+def touched_windows(array, window_size):
+    # Reference count: a sliding window (stride 1) is touched if any of its elements is positive
+    windows = np.lib.stride_tricks.sliding_window_view(array > 0, (window_size,) * array.ndim)
+    return np.count_nonzero(windows.any(axis=tuple(range(array.ndim, 2 * array.ndim))))
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_touched_windows_of_real_valued_input_with_empty_regions(dtype):
+    rng = np.random.default_rng(0)
+    array = (rng.random((48, 48, 48)) * 1000).astype(dtype)
+    # Empty regions whose window sums cancel to rounding noise in a floating point summed-area table
+    array[10:30, 10:30, 10:30] = 0
+    array[:, 40:, :] = 0
+
+    fd = FracND(min_box_size=1, max_box_size=3, n_samples=3, multiprocess=False)
+    fd(array)
+
+    assert list(fd.scales) == [2, 4, 8]
+    for scale, N in zip(fd.scales, fd.Ns):
+        norm = fd.normalization(array.shape, scale, 1)
+        assert N == int(touched_windows(array, scale) * norm)
+
+
+def test_integer_valued_float_input_matches_integer_input():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 3, (32, 32, 32)).astype(np.uint8)
+    labels[5:20, 5:20, 5:20] = 0
+
+    integer_fd = FracND(min_box_size=1, max_box_size=3, n_samples=3, multiprocess=False)
+    integer_fd(labels)
+    float_fd = FracND(min_box_size=1, max_box_size=3, n_samples=3, multiprocess=False)
+    float_fd(labels.astype(np.float32))
+
+    assert np.array_equal(integer_fd.Ns, float_fd.Ns)
+    assert np.allclose(integer_fd.lacunarity_spectrum, float_fd.lacunarity_spectrum)
+
+
+def test_greyscale_to_binary_keeps_the_top_level():
+    rng = np.random.default_rng(0)
+    levels = greyscale_to_levels(rng.random((8, 8, 8)))
+    assert levels.dtype == np.uint8 and levels.max() == 255
+
+    binary = greyscale_to_binary(levels)
+
+    assert binary.shape == (8, 8, 8, 256)
+    assert np.all(binary.sum(axis=-1) == 1)